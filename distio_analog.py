@@ -0,0 +1,188 @@
+# distio_analog
+#
+# Analog input sampling pipeline
+#
+# Adapters deliver ADC samples in blocks through the bank hook
+# readAnalogSamples(), called every blockMs; each block is copied
+# into a preallocated per-channel ring buffer with no per-sample
+# Python work. Every windowMs the samples which arrived during
+# the window are decimated in one pass (mean, min, max and RMS,
+# vectorized with NumPy when it is installed and with the C
+# builtins over an array('d') otherwise) and published only when
+# the mean moves by more than the channel's deadband:
+#
+# io/{client-name}/adc-input/{channel_num}/value [mean, retained]
+# io/{client-name}/adc-input/{channel_num}/stats [json]
+#
+# stats holds mean, min, max, rms and the sample count. A
+# channel is republished at least every maxIntervalSecs.
+#
+# Configured with the "analogInputs" config object; per-channel
+# entries override the defaults:
+#
+# "analogInputs": {
+#     "sampleRateHz": 1000, "blockMs": 50, "windowMs": 1000,
+#     "deadband": 0.01, "deadbandPercent": 0, "maxIntervalSecs": 60,
+#     "channels": {"0": {"scale": 0.0025, "offset": -4.0, "precision": 3}}
+# }
+#
+# scale and offset convert raw samples to engineering units; a
+# change is published when it exceeds deadband (units) or
+# deadbandPercent of the last published value, whichever is set
+# (deadband applies while the last published value is 0).
+#
+
+import math
+import operator
+from array import array
+
+# numpy is imported by the first ring buffer created, so adapters
+# without ADC channels never pay for it at startup
+numpy = None
+numpyChecked = False
+
+def loadNumpy():
+	global numpy, numpyChecked
+	if not numpyChecked:
+		numpyChecked = True
+		try:
+			import numpy as module
+			numpy = module
+		except ImportError:
+			pass
+	return numpy
+
+class distio_sample_ring():
+
+	def __init__(self, capacity):
+
+		self.capacity = max(1, int(capacity))
+		if loadNumpy() is not None:
+			self.buffer = numpy.zeros(self.capacity)
+		else:
+			self.buffer = array("d", [0.0]) * self.capacity
+
+		# total samples ever written; the write position is
+		# head modulo capacity
+		self.head = 0
+
+	def extend(self, samples):
+
+		count = len(samples)
+		if count > self.capacity:
+			samples = samples[count - self.capacity:]
+			self.head += count - self.capacity
+			count = self.capacity
+		if numpy is None and not isinstance(samples, array):
+			samples = array("d", samples)
+
+		start = self.head % self.capacity
+		first = min(count, self.capacity - start)
+		self.buffer[start:start + first] = samples[:first]
+		if first < count:
+			self.buffer[:count - first] = samples[first:]
+		self.head += count
+
+	# the newest count samples as at most two slices, oldest first
+	def segments(self, count):
+		count = min(count, self.capacity, self.head)
+		if not count:
+			return []
+		end = self.head % self.capacity
+		start = end - count
+		if start >= 0:
+			return [self.buffer[start:end]]
+		return [self.buffer[start + self.capacity:], self.buffer[:end]]
+
+if hasattr(math, "sumprod"):
+	def _sumSquares(segment):
+		return math.sumprod(segment, segment)
+else:
+	def _sumSquares(segment):
+		return sum(map(operator.mul, segment, segment))
+
+# (count, mean, min, max, mean square) over the segments
+def decimate(segments):
+
+	count = sum(len(segment) for segment in segments)
+	if not count:
+		return None
+
+	if numpy is not None:
+		total = sum(float(numpy.sum(segment)) for segment in segments)
+		squares = sum(float(numpy.dot(segment, segment)) for segment in segments)
+		low = min(float(numpy.min(segment)) for segment in segments if len(segment))
+		high = max(float(numpy.max(segment)) for segment in segments if len(segment))
+	else:
+		# C builtins over the array; each sample is only boxed
+		# transiently while it is read, and sumprod (3.12+) forms
+		# the squares without an intermediate float per product
+		total = sum(sum(segment) for segment in segments)
+		squares = sum(_sumSquares(segment) for segment in segments)
+		low = min(min(segment) for segment in segments if len(segment))
+		high = max(max(segment) for segment in segments if len(segment))
+
+	return count, total / count, low, high, squares / count
+
+class distio_analog_channel():
+
+	def __init__(self, capacity, scale=1.0, offset=0.0, deadband=0.0, deadbandPercent=0.0,
+			maxIntervalSecs=60, precision=4):
+
+		self.ring = distio_sample_ring(capacity)
+		self.scale = scale
+		self.offset = offset
+		self.deadband = deadband
+		self.deadbandPercent = deadbandPercent
+		self.maxIntervalSecs = maxIntervalSecs
+		self.precision = precision
+
+		# ring head at the start of the current window
+		self.windowStart = 0
+		self.published = None
+		self.publishedTime = None
+
+	@classmethod
+	def fromConfig(cls, params, capacity):
+		return cls(capacity, float(params.get("scale", 1.0)), float(params.get("offset", 0.0)),
+			float(params.get("deadband", 0.0)), float(params.get("deadbandPercent", 0.0)),
+			float(params.get("maxIntervalSecs", 60)), int(params.get("precision", 4)))
+
+	# decimate the samples of the window just ended into
+	# engineering units; None if no samples arrived
+	def closeWindow(self):
+
+		result = decimate(self.ring.segments(self.ring.head - self.windowStart))
+		self.windowStart = self.ring.head
+		if result is None:
+			return None
+
+		count, mean, low, high, meanSquare = result
+		scale = self.scale
+		offset = self.offset
+
+		# rms of (scale * x + offset) from the raw moments
+		square = (scale * scale * meanSquare) + (2 * scale * offset * mean) + (offset * offset)
+
+		stats = {}
+		stats["count"] = count
+		stats["mean"] = round(scale * mean + offset, self.precision)
+		stats["min"] = round(min(scale * low, scale * high) + offset, self.precision)
+		stats["max"] = round(max(scale * low, scale * high) + offset, self.precision)
+		stats["rms"] = round(math.sqrt(max(0.0, square)), self.precision)
+		return stats
+
+	# deadband test against the last published mean
+	def due(self, value, now):
+
+		if self.published is None:
+			return True
+		if (self.maxIntervalSecs > 0) and (now - self.publishedTime >= self.maxIntervalSecs):
+			return True
+
+		# a percentage of zero is no band at all; fall back to
+		# the absolute deadband while the published mean is 0
+		change = abs(value - self.published)
+		if (self.deadbandPercent > 0) and self.published:
+			return change >= abs(self.published) * (self.deadbandPercent / 100.0)
+		return change > self.deadband
@@ -0,0 +1,215 @@
+# distio_async
+#
+# asyncio engine for distio_client
+#
+# Selected with "engine": "asyncio" in the config. Instead of
+# paho's network thread, the condition based mainloop and the
+# state writer thread, everything runs on one asyncio event
+# loop: mqtt socket I/O, pulse and poll timers, cache flush
+# scheduling and hardware input events (queued by listener threads in
+# each bank's input event ring). On single core boards this removes thread
+# context switches and lock contention from every event.
+#
+# The exceptions are paho's blocking connect and the state cache
+# write itself, which run in the loop's default executor so that
+# an unreachable broker or a slow SD card never holds up the loop.
+#
+# distio_async_scheduler offers the distio_scheduler interface
+# on top of the event loop, so banks and adapters are unaware
+# of which engine is running.
+#
+
+import asyncio
+import math
+import threading
+
+from distio_scheduler import distio_timer, callbackSafe
+
+class distio_async_scheduler():
+
+	def __init__(self, tickSecs=0):
+
+		self.tickSecs = tickSecs
+		self.tickHandlers = []
+		self.tickPending = False
+		self.stopped = None
+		self.onError = None
+
+		# owner of the state until the loop runs; see
+		# distio_scheduler
+		self.threadId = threading.get_ident()
+
+		# created up front so sockets and timers may be
+		# registered before the loop starts running
+		self.loop = asyncio.new_event_loop()
+
+	def now(self):
+		return self.loop.time()
+
+	def callAt(self, deadline, callback, *args):
+		return self._schedule(self._align(deadline), 0, callback, args)
+
+	def callLater(self, delaySecs, callback, *args):
+		return self._schedule(self._align(self.now() + delaySecs), 0, callback, args)
+
+	# run on the mainloop as soon as possible; not tick aligned
+	def callSoon(self, callback, *args):
+		return self._schedule(self.now(), 0, callback, args)
+
+	def callEvery(self, intervalSecs, callback, *args):
+		return self._schedule(self._align(self.now() + intervalSecs), intervalSecs, callback, args)
+
+	def addTickHandler(self, callback):
+		self.tickHandlers.append(callback)
+
+	def _align(self, deadline):
+		if self.tickSecs <= 0:
+			return deadline
+		return math.ceil(deadline / self.tickSecs) * self.tickSecs
+
+	# handles are only touched from the loop; a timer
+	# cancelled from another thread is dropped when it fires
+	def cancel(self, timer):
+		timer.cancelled = True
+		if (timer.handle is not None) and self.onMainloop():
+			timer.handle.cancel()
+
+	def onMainloop(self):
+		return self.threadId == threading.get_ident()
+
+	def _schedule(self, deadline, interval, callback, args):
+		timer = distio_timer(deadline, interval, callback, args)
+		if self.onMainloop():
+			self._arm(timer)
+		else:
+			self.loop.call_soon_threadsafe(self._arm, timer)
+		return timer
+
+	def _arm(self, timer):
+		if not timer.cancelled:
+			timer.handle = self.loop.call_at(timer.deadline, self._fire, timer)
+
+	def _fire(self, timer):
+
+		if timer.cancelled:
+			return
+		callbackSafe(self, timer.callback, timer.args)
+
+		if timer.interval and not timer.cancelled:
+			timer.deadline += timer.interval
+			# skip missed periods rather than bursting
+			if timer.deadline <= self.now():
+				timer.deadline = self._align(self.now() + timer.interval)
+			self._arm(timer)
+
+		# timers due in the same tick become ready in the same
+		# loop iteration; the tick handlers run in the next one
+		if self.tickHandlers and not self.tickPending:
+			self.tickPending = True
+			self.loop.call_soon(self._tick)
+
+	def _tick(self):
+		self.tickPending = False
+		for handler in self.tickHandlers:
+			callbackSafe(self, handler, ())
+
+	def run(self):
+		self.loop.run_until_complete(self.runAsync())
+
+	# completes once stop() is called
+	async def runAsync(self):
+		self.threadId = threading.get_ident()
+		self.stopped = self.loop.create_future()
+		await self.stopped
+
+	def stop(self):
+		self.loop.call_soon_threadsafe(self._stop)
+
+	def _stop(self):
+		if (self.stopped is not None) and not self.stopped.done():
+			self.stopped.set_result(True)
+
+# drives a paho client from the event loop through its
+# external socket callbacks in place of loop_start()
+class distio_async_mqtt():
+
+	def __init__(self, mqttc, scheduler, miscIntervalSecs=1.0, reconnectMinSecs=1.0, reconnectMaxSecs=60.0):
+
+		# imported here rather than with the scheduler, which
+		# is created before the outputs are restored
+		import paho.mqtt.client as paho
+		self.errNoConn = paho.MQTT_ERR_NO_CONN
+
+		self.mqttc = mqttc
+		self.scheduler = scheduler
+		self.loop = scheduler.loop
+		self.miscIntervalSecs = miscIntervalSecs
+		self.miscTimer = None
+
+		# connection attempts back off exponentially
+		self.reconnectMinSecs = reconnectMinSecs
+		self.reconnectMaxSecs = reconnectMaxSecs
+		self.reconnectDelay = reconnectMinSecs
+		self.nextConnect = 0
+		self.connecting = None
+
+		mqttc.on_socket_open = self._onSocketOpen
+		mqttc.on_socket_close = self._onSocketClose
+		mqttc.on_socket_register_write = self._onSocketRegisterWrite
+		mqttc.on_socket_unregister_write = self._onSocketUnregisterWrite
+
+	# the first connection attempt is made as soon as the
+	# loop runs
+	def start(self):
+		self.scheduler.callSoon(self._loopMisc)
+		self.miscTimer = self.scheduler.callEvery(self.miscIntervalSecs, self._loopMisc)
+
+	def stop(self):
+		if self.miscTimer is not None:
+			self.scheduler.cancel(self.miscTimer)
+			self.miscTimer = None
+
+	# paho opens (and may close) its socket on the executor
+	# thread during a connection attempt; the loop's reader and
+	# writer registrations are only changed on the loop
+	def _onLoop(self, callback, *args):
+		if self.scheduler.onMainloop():
+			callback(*args)
+		else:
+			self.loop.call_soon_threadsafe(callback, *args)
+
+	def _onSocketOpen(self, client, userdata, sock):
+		self._onLoop(self.loop.add_reader, sock, client.loop_read)
+
+	def _onSocketClose(self, client, userdata, sock):
+		self._onLoop(self.loop.remove_reader, sock)
+
+	def _onSocketRegisterWrite(self, client, userdata, sock):
+		self._onLoop(self.loop.add_writer, sock, client.loop_write)
+
+	def _onSocketUnregisterWrite(self, client, userdata, sock):
+		self._onLoop(self.loop.remove_writer, sock)
+
+	# keepalives and retries; (re)connect if the broker is
+	# not connected, backing off while it is unreachable.
+	# paho's reconnect() is a blocking TCP (and TLS) connect,
+	# so it runs in the loop's executor; an unreachable broker
+	# must not stall timers and input handling for the whole
+	# connect timeout
+	def _loopMisc(self):
+		if self.connecting is not None:
+			return
+		if self.mqttc.loop_misc() != self.errNoConn:
+			return
+		if self.scheduler.now() < self.nextConnect:
+			return
+		self.connecting = self.loop.run_in_executor(None, self.mqttc.reconnect)
+		self.connecting.add_done_callback(self._onConnectAttempt)
+
+	def _onConnectAttempt(self, future):
+		self.connecting = None
+		if future.cancelled() or (future.exception() is not None):
+			self.nextConnect = self.scheduler.now() + self.reconnectDelay
+			self.reconnectDelay = min(self.reconnectMaxSecs, self.reconnectDelay * 2)
+		else:
+			self.reconnectDelay = self.reconnectMinSecs
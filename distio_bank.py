@@ -0,0 +1,853 @@
+# distio_bank
+#
+# IO bank; one set of digital inputs and outputs behind a
+# single hardware interface (a board, port expander, etc.)
+#
+# A bank owns its channel state, pulse programs, publish
+# policies and hardware hooks. The MQTT connection, scheduler,
+# state cache and statistics belong to the hosting distio_client
+# (self.client), so one process can host many banks behind one
+# connection and one mainloop.
+#
+# distio_client is itself a bank (the default, unnamed bank) so
+# single bank adapters keep their channels at
+#
+# io/{client-name}/{io-class}/{channel_num}
+#
+# while additional banks registered with distio_client.addBank()
+# are namespaced in the topic tree:
+#
+# io/{client-name}/{bank-name}/{io-class}/{channel_num}
+#
+# Hardware specific banks subclass distio_bank and reimplement
+# the stub methods, exactly as single bank adapters subclass
+# distio_client.
+#
+
+import time
+import json
+
+import distio_clock
+
+from distio_pulse import distio_pulse
+from distio_state import distio_io_state
+from distio_limiter import distio_publish_limiter
+from distio_ring import distio_event_ring
+from distio_debounce import distio_debounce_profile, distio_debouncer
+from distio_poller import distio_input_poller
+from distio_counter import distio_edge_counter
+from distio_analog import distio_analog_channel
+from distio_interlock import distio_interlocks
+from distio_topics import distio_topic_table, PAYLOAD_LEVEL
+
+QOS_AT_MOST_ONCE = 0
+QOS_AT_LEAST_ONCE = 1
+QOS_EXACTLY_ONCE = 2
+
+# level words accepted in state and pullup command payloads
+COMMAND_LEVELS = {"on": 1, "off": 0, "high": 1, "low": 0}
+
+class distio_bank():
+
+	def __init__(self, name=None):
+		self._initBank(name)
+
+	def _initBank(self, name):
+
+		self.bankName = name
+		self.client = None
+
+		# default hardware template
+		self.num_dio_inputs = 0
+		self.num_dio_outputs = 0
+		self.num_adc_inputs = 0
+		self.num_dac_outputs = 0
+		self.digitalInputPollingEnabled = True
+
+		# default debounce profile (distio_debounce) for the
+		# bank's inputs; overridden by "inputDebounce" config
+		self.inputDebounce = {}
+
+	#
+	# STUB METHODS for reimplementation
+	# in subclasses
+	#
+	def init(self):
+		pass
+
+	def start(self):
+		pass
+
+	def setDigitalOutput(self, channel, value, quiet = False):
+		return True
+
+	# write a whole output bank; word holds the desired state
+	# of every output (bit n is channel n) and mask the channels
+	# being changed. This fallback writes per channel; adapters
+	# with port expanders should reimplement it as one write
+	def setDigitalOutputs(self, word, mask):
+		for i in range(self.num_dio_outputs):
+			if (mask >> i) & 1:
+				if self.setDigitalOutput(i, (word >> i) & 1, True):
+					return True
+		return False
+
+	def setDigitalInputPullup(self, channel, value):
+		return True
+
+	# return channel state (0,1) or None if it could not be read
+	def readDigitalInput(self, channel):
+		return None
+
+	# return the whole input bank as a bitmask (bit n is
+	# channel n) or None if it could not be read. Adapters
+	# with port expanders should reimplement this with a
+	# single register read; this fallback reads per channel
+	# and keeps the cached state of unreadable channels
+	def readDigitalInputs(self):
+		word = self.state.inputs.state
+		for i in range(self.num_dio_inputs):
+			value = self.readDigitalInput(i)
+			if value is None:
+				continue
+			if value:
+				word |= (1 << i)
+			else:
+				word &= ~(1 << i)
+		return word
+
+	# bulk analog read; returns one sequence of samples per
+	# ADC channel (list, array('d') or numpy array) holding
+	# everything acquired since the previous call, or None.
+	# Called every analog blockMs on the mainloop, so adapters
+	# should drain a hardware FIFO or DMA buffer rather than
+	# convert on demand
+	def readAnalogSamples(self):
+		return None
+
+	#
+	# Bank lifecycle, driven by the hosting client
+	#
+
+	# called once the client configuration is loaded; sets up
+	# everything which must exist before mqtt commands arrive
+	def _attach(self, client):
+
+		self.client = client
+		if self.bankName is None:
+			self.topicPrefix = "io/{0}".format(client.clientName)
+		else:
+			self.topicPrefix = "io/{0}/{1}".format(client.clientName, self.bankName)
+		self.topics = distio_topic_table(self.topicPrefix, self.num_dio_inputs, self.num_dio_outputs, self.num_adc_inputs)
+
+		self._loadInputPublishPolicies()
+
+		# input events from listener threads are queued here
+		# and drained by the mainloop
+		self.inputEvents = distio_event_ring(int(self.bankParam("inputEventRingSize") or 1024))
+		self.inputDrainPending = False
+		self.inputOverflowsSeen = 0
+
+		# polled banks; see distio_poller
+		self.lastInputWord = None
+		self.inputPoller = distio_input_poller.fromConfig(client.scheduler, self.pollInputs,
+			self.bankParam("inputPolling") or {}, client.inputPollIntervalMs)
+
+		self._loadInputCounters()
+		self._loadInputDebounceProfiles()
+		self._loadAnalogInputs()
+
+		# pulse programs and their timers; transitions are
+		# collected during a scheduler tick and committed to
+		# the hardware together in one bank write
+		self.pendingOutputMask = 0
+		self.pendingOutputWord = 0
+		self.pendingCommandTimes = []
+		self.dioOutputPulse = []
+		self.dioOutputTimers = []
+		for i in range(self.num_dio_outputs):
+			self.dioOutputPulse.append(distio_pulse())
+			self.dioOutputTimers.append(None)
+		client.scheduler.addTickHandler(self._commitOutputs)
+
+		self._loadInterlocks()
+
+	# bank specific configuration from the "banks" config
+	# object, falling back to the client wide setting
+	def bankParam(self, name):
+		if self.bankName is not None:
+			banks = self.client.config.param("banks") or {}
+			params = banks.get(self.bankName, {})
+			if name in params:
+				return params[name]
+		return self.client.config.param(name)
+
+	# per-channel parameters from a config object whose
+	# "channels" entries override its defaults; a list of
+	# (params, configured) indexed by channel, configured being
+	# True if the channel has an entry of its own
+	def _channelParams(self, name, count, default=None):
+		policy = self.bankParam(name) or default or {}
+		channels = policy.get("channels", {})
+		result = []
+		for i in range(count):
+			params = dict(policy)
+			params.update(channels.get(str(i), {}))
+			result.append((params, str(i) in channels))
+		return result
+
+	def initState(self):
+
+		# Build state bitmasks and per-channel records
+		self.state = distio_io_state(self.num_dio_inputs, self.num_dio_outputs)
+		self.outputWord = 0
+
+	# resume IO state and settins
+	# cached input state is kept and will be
+	# checked immediately during the mainloop
+	# this helps by creating events only for
+	# inputs which have genuinely changed and will
+	# keep noise down between process cycles
+	def restoreState(self, cache):
+		self.state.fromCache(cache)
+
+		# Quietly set every Digital Output with one bank write
+		self.outputWord = self.state.outputs.state
+		if self.setDigitalOutputs(self.outputWord, self.state.outputs.mask):
+			self.client.writeLog("{0} unable to restore outputs".format(self.topicPrefix), "error")
+		for i in range(self.state.inputs.count):
+			self.setDigitalInputPullup(i, self.state.inputs.getPullup(i))
+
+	# compact view of the whole bank for state queries;
+	# states and pullups are bitmasks (bit n is channel n)
+	def snapshot(self):
+		inputs = self.state.inputs
+		snapshot = {}
+		snapshot["num_inputs"] = inputs.count
+		snapshot["num_outputs"] = self.state.outputs.count
+		snapshot["outputs"] = self.state.outputs.state
+		snapshot["inputs"] = inputs.state
+		snapshot["pullups"] = inputs.pullup
+		snapshot["time_last_change"] = [None if record.time_last_change is None else round(distio_clock.toWall(record.time_last_change), 3)
+			for record in inputs.channels]
+
+		# only counter inputs and pulsing outputs are listed
+		snapshot["counts"] = {}
+		for i, record in enumerate(inputs.channels):
+			if record.count is not None:
+				snapshot["counts"][str(i)] = record.count
+		snapshot["pulses"] = {}
+		for i, pulse in enumerate(self.dioOutputPulse):
+			status = pulse.status()
+			if status is not None:
+				snapshot["pulses"][str(i)] = status
+		return snapshot
+
+	#
+	# MQTT commands
+	#
+
+	def _addCommandRoutes(self, router):
+
+		# dio-output set parameter
+		# Valid Parameters:
+		# state - set output state (on/off, etc)
+		# pulse - Start pulse patten
+		router.add("dio-output", "state", self._onDigitalOutputStateCommand, self.bankName)
+		router.add("dio-output", "pulse", self._onDigitalOutputPulseCommand, self.bankName)
+
+		# dio-input set parameter
+		# pullup - enable input pullup (0,1)
+		router.add("dio-input", "pullup", self._onDigitalInputPullupCommand, self.bankName)
+
+		# count - preset (or reset) an edge counter input
+		router.add("dio-input", "count", self._onDigitalInputCountCommand, self.bankName)
+
+		# dio-output set mode
+		# gpio
+		# open collector
+		# tri-state
+
+	# validate channel string from a command topic; returns
+	# the channel number or None if it is out of range
+	def _commandChannel(self, channel, count):
+		try:
+			channel = int(channel)
+		except ValueError:
+			channel = -1
+		if (channel < 0) or (channel >= count):
+			self.client.writeLog("specified channel ({0}) is not within range of 0-{1}".format(channel, (count-1)), "error")
+			return None
+		return channel
+
+	# validate a level payload from a command topic; returns
+	# 0, 1 or None if it is not a level. Checked on the paho
+	# thread so a bad payload never reaches the mainloop
+	def _commandLevel(self, message):
+		value = COMMAND_LEVELS.get(message, message)
+		try:
+			value = int(value)
+		except ValueError:
+			value = -1
+		if not ((value == 1) or (value == 0)):
+			self.client.writeLog("value of \"{0}\" does not match 0 or 1".format(message), "error")
+			return None
+		return value
+
+	def _onDigitalOutputStateCommand(self, channel, message, topic):
+		if channel == "bank":
+			return self._onDigitalOutputBankStateCommand(message, topic)
+
+		channel = self._commandChannel(channel, self.num_dio_outputs)
+		if channel is None:
+			return True
+		value = self._commandLevel(message)
+		if value is None:
+			return True
+
+		# outputWord and the output port belong to the mainloop,
+		# which also commits pulse transitions
+		self.client.scheduler.callSoon(self._applyDigitalOutputCommand, channel, value, self.client.commandReceived)
+		if self.client.debugEnabled:
+			print("set state ch {0} to {1}".format(channel, message))
+
+	def _applyDigitalOutputCommand(self, channel, value, received):
+		self._setDigitalOutput(channel, value)
+		self.client._recordCommandLatency(received)
+
+	# [value] or [mask,value]
+	def _onDigitalOutputBankStateCommand(self, message, topic):
+		try:
+			arguments = [int(argument, 0) for argument in message.split(",")]
+		except ValueError:
+			arguments = []
+		if len(arguments) == 1:
+			arguments.insert(0, self.state.outputs.mask)
+		if len(arguments) == 2:
+			self.client.scheduler.callSoon(self._applyDigitalOutputsCommand, arguments[0], arguments[1], self.client.commandReceived)
+			return False
+
+		self.client.writeLog("bank state command requires [value] or [mask,value] \"{0}\" -> \"{1}\"".format(topic, message), "error")
+		return True
+
+	def _applyDigitalOutputsCommand(self, mask, value, received):
+		self._setDigitalOutputs(mask, value)
+		self.client._recordCommandLatency(received)
+
+	# Pulse output
+	# Length of ON
+	# Length of OFF
+	# Repetitions
+	# Time Off Between = 0
+	def _onDigitalOutputPulseCommand(self, channel, message, topic):
+		channel = self._commandChannel(channel, self.num_dio_outputs)
+		if channel is None:
+			return True
+
+		# Return if we do not have arguments
+		if not len(message):
+			self.client.writeLog("pulse command requires arguments \"{0}\"".format(topic), "error")
+			return True
+
+		arguments = []
+		if ',' in message: arguments = str(message).split(",")
+		else: arguments.append(message)
+
+		# Proceed with Pulse Call on the mainloop thread
+		# which owns the pulse programs
+		self.client.scheduler.callSoon(self._startPulse, channel, arguments, self.client.commandReceived)
+
+	def _onDigitalInputPullupCommand(self, channel, message, topic):
+		channel = self._commandChannel(channel, self.num_dio_inputs)
+		if channel is None:
+			return True
+		value = self._commandLevel(message)
+		if value is None:
+			return True
+
+		# publishes go through the outbox, which belongs to
+		# the mainloop
+		self.client.scheduler.callSoon(self._setDigitalInputPullup, channel, value)
+
+	def _onDigitalInputCountCommand(self, channel, message, topic):
+		channel = self._commandChannel(channel, self.num_dio_inputs)
+		if channel is None:
+			return True
+		if self.inputCounters[channel] is None:
+			self.client.writeLog("input {0} is not configured as a counter".format(channel), "error")
+			return True
+		try:
+			value = int(message)
+		except ValueError:
+			value = -1
+		if value < 0:
+			self.client.writeLog("count of \"{0}\" is not a positive integer".format(message), "error")
+			return True
+
+		# counters belong to the mainloop
+		self.client.scheduler.callSoon(self._presetCounter, channel, value)
+
+	#
+	# Outputs
+	#
+
+	# mainloop only; it updates outputWord and publishes
+	# through the outbox
+	def _setDigitalOutput(self, channel, value, quiet = False):
+
+		# check that requested channel exists
+		channel = int(channel)
+		if (channel < 0) or (channel >= self.num_dio_outputs):
+			# todo throw exception
+			self.client.writeLog("channel of {0} does not match 0-{1}".format(channel,self.num_dio_outputs), "error")
+			return True
+
+		# substitute supplied value
+		if (value == "on"): value = 1
+		if (value == "off"): value = 0
+		if (value == "high"): value = 1
+		if (value == "low"): value = 0
+
+		value = int(value)
+		if not ((value == 1) or (value == 0)):
+			# todo throw exception
+			self.client.writeLog("value of {0} does not match 0 or 1".format(value), "error")
+			return True
+
+		# pass to another method which will often
+		# be re-implemented in subclass
+		if not self.setDigitalOutput(channel, value):
+
+			if value:
+				self.outputWord |= (1 << channel)
+			else:
+				self.outputWord &= ~(1 << channel)
+
+			# track, publish, and set state
+			# cache state to disk
+			if not quiet:
+				self.state.outputs.set(channel, value)
+				self.client.outbox.publish(self.topics.outputState[channel], PAYLOAD_LEVEL[value], QOS_AT_LEAST_ONCE, True)
+				self.client.writeStateCache()
+
+
+	# set every output in mask to the matching bit of value
+	# with a single hardware write; mainloop only, as is
+	# _setDigitalOutput, since both update outputWord
+	def _setDigitalOutputs(self, mask, value, quiet = False):
+
+		mask &= self.state.outputs.mask
+		if not mask:
+			return False
+
+		# outputWord tracks the hardware, including quiet
+		# (pulse) transitions which are not part of state
+		word = (self.outputWord & ~mask) | (value & mask)
+		if self.setDigitalOutputs(word, mask):
+			self.client.writeLog("unable to write output bank mask {0:#x} value {1:#x}".format(mask, value), "error")
+			return True
+		self.outputWord = word
+
+		# track state; publish the channels which changed and
+		# cache state to disk once
+		if not quiet:
+			outputs = self.state.outputs
+			changed = outputs.changed(word) & mask
+			outputs.state = (outputs.state & ~mask) | (word & mask)
+			while changed:
+				bit = changed & -changed
+				changed ^= bit
+				i = bit.bit_length() - 1
+				self.client.outbox.publish(self.topics.outputState[i], PAYLOAD_LEVEL[(word >> i) & 1], QOS_AT_LEAST_ONCE, True)
+			self.client.writeStateCache()
+
+		return False
+
+	# mainloop only
+	def _setDigitalInputPullup(self, channel, value):
+
+		# check that requested channel exists
+		channel = int(channel)
+		if (channel < 0) or (channel >= self.num_dio_inputs):
+			# todo throw exception
+			return True
+
+		# substitute supplied value
+		if (value == "on"): value = 1
+		if (value == "off"): value = 0
+		if (value == "high"): value = 1
+		if (value == "low"): value = 0
+
+		value = int(value)
+
+		if not ((value == 1) or (value == 0)):
+			self.client.writeLog("value of {0} does not match 0 or 1".format(value), "error")
+			return True
+
+		# pass to another method which will often
+		# be re-implemented in subclass
+		if not self.setDigitalInputPullup(channel, value):
+
+			# track, publish, and set state
+			# cache state to disk
+			self.state.inputs.setPullup(channel, value)
+			self.client.outbox.publish(self.topics.inputPullup[channel], PAYLOAD_LEVEL[value], QOS_AT_LEAST_ONCE, True)
+
+			self.client.writeStateCache()
+
+	#
+	# Inputs
+	#
+
+	# returns a bitmask of the inputs which changed since the
+	# previous poll; the adaptive poller uses it as activity
+	def pollInputs(self):
+
+		# Read the whole bank and check against previously
+		# known state and the previous read; only flipped bits
+		# produce (raw, not yet debounced) edges
+		activity = 0
+		word = self.readDigitalInputs()
+		if word is not None:
+			changed = self.state.inputs.changed(word)
+			if self.lastInputWord is not None:
+				activity = (word ^ self.lastInputWord) & self.state.inputs.mask
+				changed |= activity
+			self.lastInputWord = word
+			timestamp = distio_clock.now()
+			while changed:
+				bit = changed & -changed
+				changed ^= bit
+				channel = bit.bit_length() - 1
+				self.digitalInputChanged(channel, (word >> channel) & 1, timestamp)
+		return activity
+
+	# digitalInputChanged(channel, new state, timestamp)
+	# Called from subclass, generally after an interrupt was
+	# generated.  Could be called as a result of polling within
+	# a subclass also. timestamp is the capture time of the edge
+	# in monotonic seconds (distio_clock), epoch seconds as
+	# passed by older adapters (see distio_clock.fromCapture),
+	# or None to use the time of the call
+	def digitalInputChanged(self, channel, state, timestamp):
+
+		if timestamp is not None:
+			timestamp = distio_clock.fromCapture(timestamp)
+
+		# bank state belongs to the mainloop; listener threads
+		# only record the edge in the event ring and wake the
+		# mainloop if a drain is not already pending
+		if not self.client.scheduler.onMainloop():
+			if timestamp is None:
+				timestamp = distio_clock.now()
+			self.inputEvents.push(channel, int(state), timestamp)
+			if not self.inputDrainPending:
+				self.inputDrainPending = True
+				self.client.scheduler.callSoon(self._drainInputEvents)
+			return
+
+		self.inputDebouncer.edge(channel, int(state), timestamp)
+
+	# mainloop; process every queued input event in one batch
+	def _drainInputEvents(self):
+		self.inputDrainPending = False
+		self.inputEvents.drain(self.inputDebouncer.edge)
+
+		# edges were dropped on a full ring; count them and
+		# resynchronize with the hardware
+		overflows = self.inputEvents.overflows
+		if overflows != self.inputOverflowsSeen:
+			self.client.stats.count("input_ring_overflows", overflows - self.inputOverflowsSeen)
+			self.client.writeLog("{0} input event ring overflowed; {1} events dropped".format(self.topicPrefix, overflows - self.inputOverflowsSeen), "error")
+			self.inputOverflowsSeen = overflows
+			self.pollInputs()
+
+	# debounced input level change; mainloop only
+	def _inputChanged(self, channel, state, timestamp):
+
+		inputs = self.state.inputs
+		state = int(state)
+		if timestamp is None:
+			timestamp = distio_clock.now()
+
+		# do we in fact have an input transition event
+		if inputs.get(channel) != state:
+
+			# counter inputs are summarized periodically
+			# rather than published per edge
+			counter = self.inputCounters[channel]
+			if counter is not None:
+				inputs.set(channel, state)
+				record = inputs.channels[channel]
+				record.time_last_change = timestamp
+				if self.interlocks is not None:
+					self.interlocks.inputChanged(channel, state, timestamp)
+				if counter.count(record, state, timestamp):
+					self._publishCounter(channel)
+				return
+
+			# build an event object
+			event = {}
+			event["value_new"] = state
+			event["value_old"] = inputs.get(channel)
+
+			# calculate elapsed time between the captured edges
+			# convert to milliseconds and round to nearest whole millisecond
+			record = inputs.channels[channel]
+			if record.time_last_change is not None:
+				event["time_elapsed"] = round((timestamp - record.time_last_change) * 1000)
+
+			# timestamp current event; wall clock for presentation
+			event["time_event"] = distio_clock.toWall(timestamp)
+
+			if self.client.debugEnabled:
+				print("input ch{0} changed from {1} to {2}".format(channel, inputs.get(channel), state))
+
+			inputs.set(channel, state)
+
+			# local interlocks react before anything is published
+			if self.interlocks is not None:
+				self.interlocks.inputChanged(channel, state, timestamp)
+
+			# publish within the channel's rate limit; when over
+			# budget the transition is counted and, if coalescing,
+			# reported on the trailing edge
+			scheduler = self.client.scheduler
+			limiter = self.inputPublishLimiters[channel]
+			if limiter.allow(scheduler.now()):
+				suppressed = limiter.takeSuppressed()
+				if suppressed:
+					event["suppressed"] = suppressed
+				limiter.published = state
+				self._publishInputEvent(channel, state, event)
+				self.client.stats.record("input_latency_ms", (distio_clock.now() - timestamp) * 1000)
+			elif limiter.coalesce and (limiter.trailingTimer is None):
+				limiter.trailingTimer = scheduler.callLater(limiter.delay(scheduler.now()), self._publishCoalescedInput, channel)
+
+			# store this event for calculation of event duraction
+			record.time_last_change = timestamp
+
+	# debounce profiles, from the config or the bank default.
+	# Counter inputs are not debounced unless their channel is
+	# configured explicitly; a window meant for a push button
+	# would swallow most edges of a pulse meter
+	def _loadInputDebounceProfiles(self):
+		profiles = []
+		for i, (params, configured) in enumerate(self._channelParams("inputDebounce", self.num_dio_inputs, self.inputDebounce)):
+			if (self.inputCounters[i] is not None) and not configured:
+				profiles.append(distio_debounce_profile())
+				continue
+			try:
+				profiles.append(distio_debounce_profile.fromConfig(params))
+			except ValueError as e:
+				self.client.writeLog("{0} input {1}: {2}; debounce disabled".format(self.topicPrefix, i, e), "error")
+				profiles.append(distio_debounce_profile())
+		self.inputDebouncer = distio_debouncer(self.client.scheduler, profiles, self._debouncedLevel, self._inputChanged)
+
+	def _debouncedLevel(self, channel):
+		return self.state.inputs.get(channel)
+
+	# edge counting inputs; channels not listed are None
+	def _loadInputCounters(self):
+		self.inputCounters = [None] * self.num_dio_inputs
+		for i, (params, configured) in enumerate(self._channelParams("inputCounters", self.num_dio_inputs)):
+			if not configured:
+				continue
+			try:
+				counter = distio_edge_counter.fromConfig(params)
+			except ValueError as e:
+				self.client.writeLog("{0} input {1}: {2}; not counting".format(self.topicPrefix, i, e), "error")
+				continue
+			if counter.intervalSecs > 0:
+				counter.timer = self.client.scheduler.callEvery(counter.intervalSecs, self._publishCounter, i)
+			self.inputCounters[i] = counter
+
+	def _publishCounter(self, channel):
+		counter = self.inputCounters[channel]
+		record = self.state.inputs.channels[channel]
+		if not counter.due(record):
+			return
+		changed = (record.count or 0) != counter.publishedCount
+		summary = counter.summary(record, distio_clock.now())
+		self.client.outbox.publish(self.topics.inputCounter[channel], json.dumps(summary), QOS_AT_LEAST_ONCE, True)
+		self.client.stats.count("counter_publishes")
+
+		# running totals are persisted once per summary
+		if changed:
+			self.client.writeStateCache()
+
+	def _presetCounter(self, channel, value):
+		self.state.inputs.channels[channel].count = value
+		self.inputCounters[channel].restart()
+		self._publishCounter(channel)
+
+	#
+	# Interlocks
+	#
+
+	# rules which fail to compile are logged and skipped
+	def _loadInterlocks(self):
+		interlocks = distio_interlocks(self)
+		for index, spec in enumerate(self.bankParam("interlocks") or []):
+			try:
+				interlocks.add(index, spec)
+			except (ValueError, TypeError, AttributeError) as e:
+				self.client.writeLog("{0} interlock {1}: {2}; rule ignored".format(self.topicPrefix, index, e), "error")
+		self.interlocks = interlocks if len(interlocks) else None
+
+	def _publishInterlockEvent(self, rule, channel, level, timestamp):
+		event = {}
+		event["input"] = channel
+		event["value_new"] = level
+		event["actions"] = [description for action, delaySecs, description in rule.actions]
+		event["time_event"] = distio_clock.toWall(timestamp)
+		self.client.outbox.publish(rule.topic, json.dumps(event))
+		self.client.stats.count("interlock_fires")
+		self.client.stats.record("interlock_latency_ms", (distio_clock.now() - timestamp) * 1000)
+
+	#
+	# Analog inputs
+	#
+
+	# analog channels and their ring buffers; sized to hold
+	# a window of samples at the configured rate with headroom
+	def _loadAnalogInputs(self):
+		policy = self.bankParam("analogInputs") or {}
+		self.analogSampleRateHz = float(policy.get("sampleRateHz", 1000))
+		self.analogBlockSecs = float(policy.get("blockMs", 50)) / 1000.0
+		self.analogWindowSecs = float(policy.get("windowMs", 1000)) / 1000.0
+		capacity = int(self.analogSampleRateHz * (self.analogWindowSecs + self.analogBlockSecs) * 1.25) + 1
+		self.analogInputs = [distio_analog_channel.fromConfig(params, capacity)
+			for params, configured in self._channelParams("analogInputs", self.num_adc_inputs)]
+		self.analogTimers = []
+
+	def startAnalogInputs(self):
+		if self.analogInputs and not self.analogTimers:
+			self.analogTimers.append(self.client.scheduler.callEvery(self.analogBlockSecs, self.sampleAnalogInputs))
+			self.analogTimers.append(self.client.scheduler.callEvery(self.analogWindowSecs, self._publishAnalogInputs))
+
+	# copy a block of samples per channel into the rings
+	def sampleAnalogInputs(self):
+		blocks = self.readAnalogSamples()
+		if blocks is None:
+			return
+		count = 0
+		for channel, samples in zip(self.analogInputs, blocks):
+			channel.ring.extend(samples)
+			count += len(samples)
+		self.client.stats.count("adc_samples", count)
+
+	# decimate every channel's window; publish outside deadband
+	def _publishAnalogInputs(self):
+		now = distio_clock.now()
+		for i, channel in enumerate(self.analogInputs):
+			stats = channel.closeWindow()
+			if (stats is None) or not channel.due(stats["mean"], now):
+				continue
+			channel.published = stats["mean"]
+			channel.publishedTime = now
+			self.client.outbox.publish(self.topics.analogValue[i], repr(stats["mean"]), QOS_AT_LEAST_ONCE, True)
+			self.client.outbox.publish(self.topics.analogStats[i], json.dumps(stats), QOS_AT_MOST_ONCE)
+			self.client.stats.count("adc_publishes")
+
+	# rate limiting policies for input publishing
+	def _loadInputPublishPolicies(self):
+		self.inputPublishLimiters = [distio_publish_limiter.fromConfig(params)
+			for params, configured in self._channelParams("inputPublishPolicy", self.num_dio_inputs)]
+
+	def _publishInputEvent(self, channel, state, event):
+
+		self.client.outbox.publish(self.topics.inputState[channel], PAYLOAD_LEVEL[state], QOS_AT_LEAST_ONCE, True)
+
+		# send JSON event on the rise or fall transition topic
+		self.client.outbox.publish(self.topics.inputTransition[channel][state], json.dumps(event))
+		self.client.stats.count("input_events")
+
+	# trailing edge of a rate limited channel; publish the
+	# latest state along with the suppressed transition count
+	def _publishCoalescedInput(self, channel):
+
+		scheduler = self.client.scheduler
+		limiter = self.inputPublishLimiters[channel]
+		limiter.trailingTimer = None
+
+		delay = limiter.delay(scheduler.now())
+		if delay > 0:
+			limiter.trailingTimer = scheduler.callLater(delay, self._publishCoalescedInput, channel)
+			return
+
+		suppressed = limiter.takeSuppressed()
+		if not suppressed:
+			return
+		limiter.allow(scheduler.now())
+
+		state = self.state.inputs.get(channel)
+		event = {}
+		event["value_new"] = state
+		event["value_old"] = limiter.published
+		event["time_event"] = time.time()
+		event["suppressed"] = suppressed
+
+		limiter.published = state
+		self._publishInputEvent(channel, state, event)
+
+	#
+	# Pulse programs
+	#
+
+	def _startPulse(self, channel, arguments, received=None):
+		try:
+			if not self.dioOutputPulse[channel].pulse(arguments):
+				# Turn DIO Channel ON quietly
+				self._requestDigitalOutput(channel, 1)
+				if received is not None:
+					self.pendingCommandTimes.append(received)
+		except ValueError:
+			self.client.writeLog("failed to pulse output channel \"{0}\"; bad arguments".format(channel), "error")
+		self._schedulePulse(channel)
+
+	# arm a timer for the next transition of a pulse program
+	# replacing any timer already armed for the channel
+	def _schedulePulse(self, channel):
+		if self.dioOutputTimers[channel] is not None:
+			self.client.scheduler.cancel(self.dioOutputTimers[channel])
+			self.dioOutputTimers[channel] = None
+		deadline = self.dioOutputPulse[channel].nextDeadline()
+		if deadline is not None:
+			self.dioOutputTimers[channel] = self.client.scheduler.callAt(deadline, self._processPulse, channel)
+
+	def _processPulse(self, channel):
+		self.dioOutputTimers[channel] = None
+		deadline = self.dioOutputPulse[channel].nextDeadline()
+		if self.dioOutputPulse[channel].process():
+			if deadline is not None:
+				self.client.stats.record("pulse_jitter_ms", abs(distio_clock.now() - deadline) * 1000)
+			self.client.stats.count("pulse_edges")
+			self._requestDigitalOutput(channel, self.dioOutputPulse[channel].outputRequest)
+			self.dioOutputPulse[channel].outputRequest = None
+		self._schedulePulse(channel)
+
+	# queue a quiet output transition for the end of the
+	# current scheduler tick; mainloop thread only
+	def _requestDigitalOutput(self, channel, value):
+		bit = 1 << channel
+		self.pendingOutputMask |= bit
+		if value:
+			self.pendingOutputWord |= bit
+		else:
+			self.pendingOutputWord &= ~bit
+
+	# tick handler; apply every transition requested during
+	# the tick with a single bank write
+	def _commitOutputs(self):
+		if not self.pendingOutputMask:
+			return
+		mask = self.pendingOutputMask
+		word = self.pendingOutputWord
+		self.pendingOutputMask = 0
+		self.pendingOutputWord = 0
+		self._setDigitalOutputs(mask, word, True)
+
+		for received in self.pendingCommandTimes:
+			self.client._recordCommandLatency(received)
+		self.pendingCommandTimes = []
@@ -0,0 +1,522 @@
+#!/usr/bin/python3
+
+# distio_bench.py
+# Distributed IO System
+#
+# Reproducible benchmark suite for distio_client
+#
+# Drives a simulated 8 in / 8 out adapter through an in-process
+# stand-in for the paho client and broker, so results depend only
+# on distio_client itself. Workloads:
+#
+#  - command routing: legacy regex dispatch against distio_router
+#  - command flood: output state commands back to back
+#  - input storm: input edges as delivered by an interrupt listener
+#  - pulse load: blink programs on every output
+#  - cache writes: state cache flushes and write coalescing
+#  - reconnect replay: publishes held during a broker outage and
+#    replayed on reconnect
+#  - analog pipeline: 8 ADC channels sampled at 10kHz in blocks,
+#    decimated and deadband published; a known sine is checked
+#    for its mean, min, max and RMS and for deadband suppression
+#
+# Each reports throughput, p50/p99 latency in milliseconds and
+# process CPU time per event. Results are written as JSON so runs
+# can be compared for regressions.
+#
+# Usage: distio_bench.py [-o results.json] [-n events] [--quick]
+#                        [--engine thread|asyncio]
+#
+
+import sys
+import os
+import re
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+
+from distio_router import distio_router
+
+CLIENT_NAME = "bench"
+
+#
+# In-process stand-in for paho.mqtt.client.Client
+#
+
+class bench_message():
+
+	def __init__(self, topic, payload, qos=0, retain=False):
+		self.topic = topic
+		if isinstance(payload, str):
+			payload = payload.encode("utf-8")
+		self.payload = payload
+		self.qos = qos
+		self.retain = retain
+
+class bench_mqtt_client():
+
+	def __init__(self, clientName):
+		self.clientName = clientName
+		self.on_message = None
+		self.on_connect = None
+		self.on_publish = None
+		self.on_subscribe = None
+		self.on_disconnect = None
+		self.subscriptions = []
+		self.retained = {}
+		self.publishCount = 0
+		self.connected = False
+
+	def will_set(self, topic, payload=None, qos=0, retain=False):
+		pass
+
+	def connect(self, host, port=1883, keepalive=60):
+		return 0
+
+	def connect_async(self, host, port=1883, keepalive=60):
+		pass
+
+	def reconnect_delay_set(self, min_delay=1, max_delay=120):
+		pass
+
+	def loop_start(self):
+		self.connected = True
+		if self.on_connect is not None:
+			self.on_connect(self, None, {}, 0)
+
+	def loop_stop(self):
+		self.connected = False
+
+	# asyncio engine; the stand-in connects on the first
+	# housekeeping call rather than on a socket read
+	def loop_misc(self):
+		if not self.connected:
+			self.loop_start()
+		return 0
+
+	def disconnect(self):
+		self.connected = False
+		if self.on_disconnect is not None:
+			self.on_disconnect(self, None, 0)
+
+	def subscribe(self, topic, qos=0):
+		self.subscriptions.append(topic)
+		return (0, 1)
+
+	def publish(self, topic, payload=None, qos=0, retain=False):
+		self.publishCount += 1
+		if retain:
+			self.retained[topic] = payload
+		return (0, self.publishCount)
+
+	# broker delivering a message to the client; called on the
+	# benchmark thread as paho would from its network thread
+	def deliver(self, topic, payload):
+		self.on_message(self, None, bench_message(topic, payload))
+
+#
+# Simulated adapter
+#
+
+def createBenchClient(configPath):
+
+	from distio_client import distio_client
+
+	class bench_adapter(distio_client):
+
+		def init(self):
+			self.num_dio_inputs = 8
+			self.num_dio_outputs = 8
+			self.digitalInputPollingEnabled = False
+			self.auto_run = False
+			self.inputWord = 0
+			self.outputWrites = 0
+			self.bankWrites = 0
+
+			# analog blocks are only delivered during the analog
+			# workload; the same preallocated blocks every call
+			self.num_adc_inputs = 8
+			self.analogBlocks = None
+
+		def start(self):
+			pass
+
+		def createMqttClient(self, clientName):
+			return bench_mqtt_client(clientName)
+
+		def setDigitalOutput(self, channel, value, quiet = False):
+			self.outputWrites += 1
+			return False
+
+		def setDigitalOutputs(self, word, mask):
+			self.bankWrites += 1
+			return False
+
+		def setDigitalInputPullup(self, channel, value):
+			return False
+
+		def readDigitalInputs(self):
+			return self.inputWord
+
+		def readAnalogSamples(self):
+			return self.analogBlocks
+
+	# configuration is supplied as the first commandline
+	# argument, as for any distio adapter
+	argv = sys.argv
+	sys.argv = [argv[0], configPath]
+	try:
+		client = bench_adapter()
+	finally:
+		sys.argv = argv
+
+	thread = threading.Thread(target=client.run, name="distio_bench_mainloop")
+	thread.daemon = True
+	thread.start()
+
+	# wait for the (simulated) connection
+	while not client.mqttc.connected:
+		time.sleep(0.01)
+	drain(client)
+	return client, thread
+
+# block until the mainloop has processed everything handed
+# to it so far
+def drain(client):
+	done = threading.Event()
+	client.scheduler.callSoon(done.set)
+	done.wait()
+
+def stopBenchClient(client, thread):
+	client.stop()
+	thread.join()
+
+#
+# Measurement helpers
+#
+
+def percentile(samples, q):
+	if not samples:
+		return None
+	samples = sorted(samples)
+	index = min(len(samples) - 1, int(round(q * (len(samples) - 1))))
+	return samples[index]
+
+def summarize(name, count, elapsed, cpu, latencies=None, extra=None):
+	result = {}
+	result["name"] = name
+	result["count"] = count
+	result["elapsed_secs"] = round(elapsed, 6)
+	result["per_sec"] = round(count / elapsed, 1) if elapsed > 0 else None
+	result["cpu_us_per_event"] = round((cpu / count) * 1e6, 3) if count else None
+	if latencies:
+		result["p50_ms"] = round(percentile(latencies, 0.50) * 1000, 4)
+		result["p99_ms"] = round(percentile(latencies, 0.99) * 1000, 4)
+	if extra:
+		result.update(extra)
+	return result
+
+class measure():
+
+	def __enter__(self):
+		self.wallStart = time.perf_counter()
+		self.cpuStart = time.process_time()
+		return self
+
+	def __exit__(self, *args):
+		self.elapsed = time.perf_counter() - self.wallStart
+		self.cpu = time.process_time() - self.cpuStart
+
+#
+# Workloads
+#
+
+def _handler(channel, payload, topic):
+	pass
+
+# dispatch as performed by _onMqttMessage prior to the
+# routing table; patterns formatted and searched per message
+def routeLegacy(topic):
+	match = re.search("io/{0}/dio-output/([0-9]*)/set/([0-9A-Za-z]*)".format(CLIENT_NAME), topic)
+	if match:
+		if match.group(2).lower() == "state": _handler(match.group(1), "1", topic)
+		elif match.group(2).lower() == "pulse": _handler(match.group(1), "1", topic)
+	match = re.search("io/{0}/dio-input/([0-9]*)/pullup/set/([0-9A-Za-z]*)".format(CLIENT_NAME), topic)
+	if match:
+		if match.group(2).lower() == "pullup": _handler(match.group(1), "1", topic)
+
+def benchCommandRouting(count):
+
+	# a burst of commands as sent from an HMI
+	topics = ["io/{0}/dio-output/{1}/set/state".format(CLIENT_NAME, i) for i in range(6)]
+	topics.append("io/{0}/dio-output/3/set/pulse".format(CLIENT_NAME))
+	topics.append("io/{0}/dio-input/2/set/pullup".format(CLIENT_NAME))
+
+	router = distio_router("io/{0}".format(CLIENT_NAME))
+	router.add("dio-output", "state", _handler)
+	router.add("dio-output", "pulse", _handler)
+	router.add("dio-input", "pullup", _handler)
+
+	results = []
+	for name, route in (("routing_legacy_regex", routeLegacy), ("routing_router", lambda topic: router.dispatch(topic, "1"))):
+		with measure() as m:
+			for i in range(count):
+				route(topics[i % len(topics)])
+		results.append(summarize(name, count, m.elapsed, m.cpu))
+	return results
+
+def benchCommandFlood(client, count):
+	latencies = []
+	writesStart = client.outputWrites
+	with measure() as m:
+		for i in range(count):
+			topic = "io/{0}/dio-output/{1}/set/state".format(CLIENT_NAME, i % 8)
+			timeStart = time.perf_counter()
+			client.mqttc.deliver(topic, str((i >> 3) & 1))
+			latencies.append(time.perf_counter() - timeStart)
+	return summarize("command_flood", count, m.elapsed, m.cpu, latencies,
+		{"hardware_writes": client.outputWrites - writesStart})
+
+# edges are delivered from this thread, as from a hardware
+# listener thread; latency is event timestamp to publish as
+# recorded by the client
+def benchInputStorm(client, count):
+	client.stats.snapshot()
+	publishStart = client.mqttc.publishCount
+	with measure() as m:
+		for i in range(count):
+			client.digitalInputChanged(i % 8, ((i >> 3) & 1) ^ 1, time.monotonic())
+		drain(client)
+	latency = client.stats.snapshot()["histograms"].get("input_latency_ms", {})
+	return summarize("input_storm", count, m.elapsed, m.cpu, None, {
+		"publishes": client.mqttc.publishCount - publishStart,
+		"p50_ms": latency.get("p50"),
+		"p99_ms": latency.get("p99"),
+	})
+
+def benchPulseLoad(client, durationSecs, periodMs=5):
+	client.stats.snapshot()
+	writesStart = client.bankWrites
+	with measure() as m:
+		for i in range(8):
+			client.mqttc.deliver("io/{0}/dio-output/{1}/set/pulse".format(CLIENT_NAME, i), "{0},{0}".format(periodMs))
+		time.sleep(durationSecs)
+		for i in range(8):
+			client.mqttc.deliver("io/{0}/dio-output/{1}/set/pulse".format(CLIENT_NAME, i), "0")
+		time.sleep(0.05)
+	snapshot = client.stats.snapshot()
+	edges = snapshot["counters"].get("pulse_edges", 0)
+	jitter = snapshot["histograms"].get("pulse_jitter_ms", {})
+	return summarize("pulse_load", edges, m.elapsed, m.cpu, None, {
+		"bank_writes": client.bankWrites - writesStart,
+		"jitter_p50_ms": jitter.get("p50"),
+		"jitter_p99_ms": jitter.get("p99"),
+	})
+
+def benchCacheWrites(client, count):
+
+	# direct flushes of one changed output; the cost of a
+	# single cache (or journal) write
+	latencies = []
+	with measure() as m:
+		for i in range(count):
+			client.state.outputs.set(i % 8, ((i >> 3) & 1) ^ 1)
+			client.writeStateCache()
+			timeStart = time.perf_counter()
+			client.stateWriter.flush()
+			latencies.append(time.perf_counter() - timeStart)
+	results = [summarize("cache_write", count, m.elapsed, m.cpu, latencies)]
+
+	# writes incurred by a command flood through the
+	# write-behind writer
+	writesStart = client.stateWriter.writeCount
+	with measure() as m:
+		for i in range(count):
+			client.mqttc.deliver("io/{0}/dio-output/{1}/set/state".format(CLIENT_NAME, i % 8), str(i & 1))
+		client.stateWriter.flush()
+	results.append(summarize("cache_coalescing", count, m.elapsed, m.cpu, None,
+		{"disk_writes": client.stateWriter.writeCount - writesStart}))
+	return results
+
+# commands and input edges during a broker outage, then the
+# time from reconnect until the outbox has been replayed
+def benchReconnectReplay(client, count):
+
+	client.mqttc.disconnect()
+	drain(client)
+	for i in range(count):
+		client.mqttc.deliver("io/{0}/dio-output/{1}/set/state".format(CLIENT_NAME, i % 8), str((i >> 3) & 1))
+		client.digitalInputChanged(i % 8, ((i >> 3) & 1) ^ 1, time.monotonic())
+	drain(client)
+
+	queued = len(client.outbox.state) + len(client.outbox.events)
+	publishStart = client.mqttc.publishCount
+	with measure() as m:
+		client.mqttc.loop_start()
+		while True:
+			drain(client)
+			if not client.outbox.pending():
+				break
+			time.sleep(0.001)
+	return summarize("reconnect_replay", count * 2, m.elapsed, m.cpu, None, {
+		"queued": queued,
+		"replayed": client.mqttc.publishCount - publishStart,
+		"dropped": client.outbox.dropped,
+	})
+
+# a known sine through one analog channel; returns the list of
+# failed checks
+def checkAnalogPipeline():
+
+	from array import array
+	import math
+	from distio_analog import distio_analog_channel
+
+	failures = []
+	def check(name, value, expected):
+		if abs(value - expected) > 1e-6 * max(1.0, abs(expected)):
+			failures.append("{0}: {1} != {2}".format(name, value, expected))
+
+	# whole periods of 2048 + 1000 sin, scaled by 0.5 - 1; the
+	# ring is sized so the second window wraps around its end
+	period = 1000
+	block = array("d", (2048.0 + 1000.0 * math.sin(2 * math.pi * i / period) for i in range(period)))
+	channel = distio_analog_channel(1500, scale=0.5, offset=-1.0, deadband=0.5, maxIntervalSecs=0, precision=6)
+	for window in range(2):
+		channel.ring.extend(block)
+		stats = channel.closeWindow()
+		check("count", stats["count"], period)
+		check("mean", stats["mean"], 1023.0)
+		check("min", stats["min"], 523.0)
+		check("max", stats["max"], 1523.0)
+		check("rms", stats["rms"], round(math.sqrt(1023.0 ** 2 + (500.0 ** 2) / 2), 6))
+
+	# deadband; an unchanged or small move is suppressed
+	if not channel.due(1023.0, 0):
+		failures.append("deadband: first value not published")
+	channel.published = 1023.0
+	channel.publishedTime = 0
+	if channel.due(1023.0, 1) or channel.due(1023.4, 1):
+		failures.append("deadband: change within 0.5 published")
+	if not channel.due(1023.6, 1):
+		failures.append("deadband: change beyond 0.5 suppressed")
+
+	# a percentage band around a published 0 is no band
+	channel = distio_analog_channel(16, deadbandPercent=1.0)
+	channel.published = 0.0
+	channel.publishedTime = 0
+	if channel.due(0.0, 1):
+		failures.append("deadbandPercent: unchanged 0 published")
+	if not channel.due(0.1, 1):
+		failures.append("deadbandPercent: change from 0 suppressed")
+	return failures
+
+def benchAnalogPipeline(client, durationSecs):
+
+	from array import array
+	import math
+
+	# one block of a sine per channel, as delivered every blockMs
+	blockSize = int(client.analogSampleRateHz * client.analogBlockSecs)
+	block = array("d", (2048.0 + 1000.0 * math.sin(2 * math.pi * i / blockSize) for i in range(blockSize)))
+	client.stats.snapshot()
+	with measure() as m:
+		client.analogBlocks = [block] * client.num_adc_inputs
+		time.sleep(durationSecs)
+		client.analogBlocks = None
+		drain(client)
+	snapshot = client.stats.snapshot()
+	samples = snapshot["counters"].get("adc_samples", 0)
+
+	# every window holds whole periods of the same sine, so the
+	# deadband allows exactly one publish per channel at the
+	# sine's mean
+	failures = checkAnalogPipeline()
+	publishes = snapshot["counters"].get("adc_publishes", 0)
+	if publishes != client.num_adc_inputs:
+		failures.append("publishes: {0} != {1}".format(publishes, client.num_adc_inputs))
+	for i, channel in enumerate(client.analogInputs):
+		if (channel.published is None) or (abs(channel.published - 2048.0) > 1e-3):
+			failures.append("channel {0} published {1} != 2048".format(i, channel.published))
+
+	return summarize("analog_pipeline", samples, m.elapsed, m.cpu, None, {
+		"publishes": publishes,
+		"numpy": __import__("distio_analog").numpy is not None,
+		"failures": failures,
+	})
+
+def runSuite(count, pulseSecs, engine="thread"):
+
+	workdir = tempfile.mkdtemp(prefix="distio_bench_")
+	configPath = os.path.join(workdir, "bench.cfg")
+	with open(configPath, "w") as outfile:
+		json.dump({
+			"mqtt": {"clientName": CLIENT_NAME, "remoteHost": "localhost", "remotePort": 1883},
+			"stateCacheFile": os.path.join(workdir, "bench.cache"),
+			"statsIntervalSecs": 0,
+			"engine": engine,
+			"offlineQueue": {"replayPerSec": 20000},
+			"analogInputs": {"sampleRateHz": 10000, "blockMs": 10, "windowMs": 100, "deadband": 1.0},
+		}, outfile)
+
+	results = []
+	results.extend(benchCommandRouting(count))
+
+	client, thread = createBenchClient(configPath)
+	try:
+		results.append(benchCommandFlood(client, count))
+		results.append(benchInputStorm(client, count))
+		results.append(benchPulseLoad(client, pulseSecs))
+		results.extend(benchCacheWrites(client, min(count, 200)))
+		results.append(benchAnalogPipeline(client, pulseSecs))
+		results.append(benchReconnectReplay(client, count))
+	finally:
+		stopBenchClient(client, thread)
+
+	report = {}
+	report["time"] = time.time()
+	report["python"] = platform.python_version()
+	report["machine"] = platform.machine()
+	report["events"] = count
+	report["engine"] = engine
+	report["results"] = results
+	return report
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description="distio_client benchmark suite")
+	parser.add_argument("-o", "--output", default="distio_bench.json", help="JSON results file")
+	parser.add_argument("-n", "--events", type=int, default=20000, help="events per workload")
+	parser.add_argument("--quick", action="store_true", help="short run for smoke testing")
+	parser.add_argument("--engine", default="thread", choices=("thread", "asyncio"), help="client engine")
+	args = parser.parse_args()
+
+	count = args.events
+	pulseSecs = 2.0
+	if args.quick:
+		count = min(count, 2000)
+		pulseSecs = 0.25
+
+	report = runSuite(count, pulseSecs, args.engine)
+
+	for result in report["results"]:
+		line = "{0:<22} {1:>12} /sec".format(result["name"], result["per_sec"])
+		if result.get("p50_ms") is not None:
+			line += "  p50 {0:.4f} ms  p99 {1:.4f} ms".format(result["p50_ms"], result["p99_ms"])
+		if result["cpu_us_per_event"] is not None:
+			line += "  cpu {0:.2f} us/event".format(result["cpu_us_per_event"])
+		print(line)
+
+	with open(args.output, "w") as outfile:
+		json.dump(report, outfile, indent=1)
+	print("results written to {0}".format(args.output))
+
+	# workloads which verify their output report failed checks
+	failures = [failure for result in report["results"] for failure in result.get("failures", [])]
+	for failure in failures:
+		print("check failed: {0}".format(failure))
+	if failures:
+		sys.exit(1)
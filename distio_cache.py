@@ -0,0 +1,136 @@
+# distio_cache
+#
+# Write-behind persistence of the IO state cache
+#
+# Callers mark the state dirty; a background thread writes it
+# at most once per interval so a flood of output commands costs
+# one disk write per interval instead of one per command, and
+# the disk write is kept out of the paho callback thread.
+#
+# Writes are atomic: the document goes to a temporary file in
+# the same directory which is fsync'd and then renamed over the
+# cache, so a power cut can never leave a half-written cache.
+#
+# A failed write (full or read-only filesystem, missing
+# directory) leaves the state dirty and is retried after the
+# next interval. Failures are counted as cache_write_errors and
+# the first of a run is passed to onError(exception).
+#
+
+import os
+import threading
+import time
+
+class distio_cache_writer():
+
+	# serialize() is called from the writer thread and must
+	# return the complete document as a str or bytes
+	# optional stats (distio_stats) receives write durations
+	def __init__(self, path, serialize, intervalMs=500, stats=None):
+
+		self.path = path
+		self.serialize = serialize
+		self.intervalSecs = intervalMs / 1000.0
+		self.stats = stats
+
+		self.dirty = False
+		self.stopping = False
+		self.lastWrite = 0
+		self.writeCount = 0
+		self.writeErrors = 0
+		self.onError = None
+		self.condition = threading.Condition()
+		self.writeLock = threading.Lock()
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target=self._run, name="distio_cache_writer")
+		self.thread.daemon = True
+		self.thread.start()
+
+	# final flush; blocks until the cache is on disk
+	def stop(self):
+		with self.condition:
+			self.stopping = True
+			self.condition.notify()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+		self.flush()
+
+	def markDirty(self):
+		with self.condition:
+			if not self.dirty:
+				self.dirty = True
+				self.condition.notify()
+
+	# write now if dirty; may be called from any thread
+	def flush(self):
+		with self.writeLock:
+			with self.condition:
+				if not self.dirty:
+					return False
+				self.dirty = False
+			timeStart = time.monotonic()
+			try:
+				self.write(self.serialize())
+			except OSError as e:
+				self._writeFailed(e)
+				return False
+			self.lastWrite = time.monotonic()
+			self.writeCount += 1
+			self.writeErrors = 0
+			if self.stats is not None:
+				self.stats.record("cache_write_ms", (self.lastWrite - timeStart) * 1000)
+		return True
+
+	# keep the state dirty and back off for an interval
+	def _writeFailed(self, error):
+		self.lastWrite = time.monotonic()
+		with self.condition:
+			self.dirty = True
+		self.writeErrors += 1
+		if self.stats is not None:
+			self.stats.count("cache_write_errors")
+		if (self.writeErrors == 1) and (self.onError is not None):
+			self.onError(error)
+
+	def write(self, data):
+
+		if isinstance(data, str):
+			data = data.encode("utf-8")
+
+		tempPath = "{0}.tmp".format(self.path)
+		with open(tempPath, "wb") as outfile:
+			outfile.write(data)
+			outfile.flush()
+			os.fsync(outfile.fileno())
+		os.replace(tempPath, self.path)
+
+		# persist the rename itself
+		try:
+			dirFd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+			try:
+				os.fsync(dirFd)
+			finally:
+				os.close(dirFd)
+		except OSError:
+			pass
+
+	def _run(self):
+		while True:
+			with self.condition:
+				while not (self.dirty or self.stopping):
+					self.condition.wait()
+				if self.stopping:
+					return
+
+				# coalesce changes until an interval has
+				# passed since the previous write
+				delay = self.lastWrite + self.intervalSecs - time.monotonic()
+				if delay > 0:
+					self.condition.wait(delay)
+					if self.stopping:
+						return
+
+			self.flush()
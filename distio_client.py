@@ -10,6 +10,10 @@
 # Basic Structure
 # io/{client-name}/{io-class}/{channel_num}
 #
+# Additional IO banks hosted by the same client (see distio_bank)
+# are namespaced by bank name:
+# io/{client-name}/{bank-name}/{io-class}/{channel_num}
+#
 # DIGITAL INPUT COMMANDS
 #
 # io/{client-name}/dio-input/{channel_num}/set/{parameter}
@@ -17,16 +21,21 @@
 #  - state: set output to state (0,1)
 #  - pullup: set input pullups if available (0,1)
 #  - pulse: set output to pulse
+#  - count: preset the running total of a counter input
 #
 # DIGITAL INPUT RESPONSES
 #
 # io/{client-name}/dio-input/{channel_num}/state [basic value (0,1)]
 # io/{client-name}/dio-input/{channel_num}/event/transition/{direction} [json event]
+# io/{client-name}/dio-input/{channel_num}/counter [json summary]
+#   counter inputs only; see distio_counter and "inputCounters"
 # json event
 # - value_old
 # - value_new
 # - time_event (elapsed epoch seconds)
 # - time_elapsed (elapsed time in ms)
+# - suppressed (transitions not published due to the channel's
+#   publish policy since the previous event; see distio_limiter)
 #
 # DIGITAL OUTPUT COMMANDS
 #
@@ -35,41 +44,132 @@
 #   value - set output state (0,1) or ("on", "off")
 #   pullup - 
 #
+# io/{client-name}/dio-output/bank/set/state [value] or [mask,value]
+# Set many outputs with one hardware write. value and mask are
+# bitmasks (bit n is channel n) in any python integer notation
+# (eg. 0x0f, 0b1010, 12); without a mask every output is set
+#
+# ENGINES
+#
+# "engine": "thread" (default) runs paho's network thread, the
+# scheduler mainloop and a state writer thread. "engine": "asyncio"
+# runs mqtt I/O, timers, cache flushes and hardware event intake
+# on one asyncio event loop (see distio_async); shut it down with
+# "await client.shutdown()" or SIGINT/SIGTERM.
+#
+# STATE CACHE
+#
+# "stateStore": "journal" (default) appends changed channels to a
+# binary journal (stateJournalFile, see distio_journal) which is
+# compacted every stateJournalCompactRecords records; a journal
+# recovered intact is appended to across restarts. An existing
+# JSON cache (stateCacheFile) is imported when there is no journal.
+# "stateStore": "json" rewrites the whole JSON cache instead.
+#
+# STATISTICS
+#
+# clients/{client-name}/stats [json snapshot every statsIntervalSecs]
+# - counters and rates (per second) over the interval
+# - latency histograms (ms) with count, mean, max, p50, p99 and
+#   bucket counts against bucket_bounds_ms:
+#   command_latency_ms - mqtt receive to hardware write
+#   input_latency_ms - input event timestamp to publish
+#   pulse_jitter_ms - pulse edge against its scheduled time
+#   cache_write_ms - state cache write duration
+#   interlock_latency_ms - input edge to interlock actions applied
+# - input_rings: per bank input event ring depth, high water
+#   mark and overflow (dropped event) count
+# - startup: outputs_restored_ms and online_ms, time from client
+#   start until outputs were restored from the cache and until the
+#   broker connection was first established
+# - outbox: IO publishes held while offline; pending_state
+#   (coalesced retained topics), pending_events, spool_bytes and
+#   dropped (see distio_outbox and "offlineQueue")
+# - input_polling: per polled bank average poll cost (ms), current
+#   poll interval (ms) and total polls
+#
+# ANALOG INPUT RESPONSES
+#
+# io/{client-name}/adc-input/{channel_num}/value [mean, engineering units]
+# io/{client-name}/adc-input/{channel_num}/stats [json mean, min, max, rms, count]
+# published per window when outside the deadband; see distio_analog
+#
+# STATE QUERIES
+#
+# io/{client-name}/get/snapshot [correlation id or json request]
+# responds on io/{client-name}/response/snapshot (or the request's
+# response_topic) with one compact json message for all banks:
+# - correlation_id: echoed from the request
+# - banks: per bank ("" is the client's own bank) num_inputs,
+#   num_outputs, outputs, inputs and pullups (bitmasks, bit n is
+#   channel n), time_last_change (epoch seconds per input),
+#   counts (counter inputs) and pulses (running pulse programs
+#   with their args, phase, rep and set)
+#
 # DIGITAL OUTPUT RESPONSES
 #
 # io/{client-name}/dio-output/{channel_num}/state [value]
 #
+# SHARED STATE SEGMENT
+#
+# With a "stateSegment" config object the state of every bank is
+# mirrored into a memory mapped file (default /dev/shm/distio-
+# {client-name}) which same-host processes read with
+# distio_segment.distio_state_reader, optionally queueing output
+# commands through its mailbox; see distio_segment
+#
+# INTERLOCKS
+#
+# io/{client-name}/interlock/{rule-name}/event [json]
+# - input, value_new: the triggering edge
+# - actions: output actions taken (set, toggle, pulse, delay_ms)
+# - time_event (epoch seconds)
+# rules are declared with the "interlocks" config list and run
+# in the input event path; see distio_interlock
+#
 
 import sys, os
-from fnmatch import fnmatch, fnmatchcase
 import time
-import socket
-import re
-
-import paho.mqtt.client as paho
-import json, pprint
-
-from distio_pulse import distio_pulse
+import json
+import traceback
+
+from distio_bank import distio_bank, QOS_AT_MOST_ONCE, QOS_AT_LEAST_ONCE, QOS_EXACTLY_ONCE
+from distio_scheduler import distio_scheduler
+from distio_router import distio_router
+from distio_cache import distio_cache_writer
+from distio_stats import distio_stats
+from distio_outbox import distio_outbox
+from distio_segment import distio_state_segment, MAILBOX_OUTPUT_STATE, MAILBOX_OUTPUT_BANK, MAILBOX_OUTPUT_PULSE
+from distio_topics import distio_client_topics, validPublishTopic, validTopicLevel, RESERVED_BANK_NAMES, PAYLOAD_ONLINE, PAYLOAD_OFFLINE
 import c3lib.config
 
-QOS_AT_MOST_ONCE = 0
-QOS_AT_LEAST_ONCE = 1
-QOS_EXACTLY_ONCE = 2
-
-class distio_client():
+# The client is the default (unnamed) IO bank and hosts any
+# additional banks behind its one mqtt connection and mainloop
+class distio_client(distio_bank):
 
 	def __init__(self, configPath=None):
 
+		# startup metrics are measured from here
+		self.startupStart = time.monotonic()
+		self.startupMetrics = {}
+
 		# default hardware template
-		self.num_dio_inputs = 0
-		self.num_dio_outputs = 0
-		self.num_adc_inputs = 0
-		self.num_dac_outputs = 0
-		self.digitalInputPollingEnabled = True
+		self._initBank(None)
+		self.banks = {}
 		
 		# debugging and performance
 		self.debugEnabled = False
-		self.inputPollTimeMs = 0
+		self.inputPollIntervalMs = 1
+		self.stateCacheIntervalMs = 500
+		self.stateStore = "journal"
+		self.schedulerTickMs = 1
+		self.statsIntervalSecs = 60
+		self.engine = "thread"
+		self.stats = distio_stats()
+		self.commandReceived = None
+		self.mqttc = None
+		self.stateSegment = None
+		self.stateSegmentSyncPending = False
 
 		self.auto_run = True
 
@@ -79,48 +179,122 @@ class distio_client():
 		self.config.load()
 
 		# call subclass init, so we have the config options
+		# additional banks are registered here with addBank()
 		self.init()
 
+		if self.config.param("inputPollIntervalMs") is not None:
+			self.inputPollIntervalMs = float(self.config.param("inputPollIntervalMs"))
+		if self.config.param("stateCacheIntervalMs") is not None:
+			self.stateCacheIntervalMs = float(self.config.param("stateCacheIntervalMs"))
+		if self.config.param("stateStore") is not None:
+			self.stateStore = self.config.param("stateStore")
+		if self.config.param("schedulerTickMs") is not None:
+			self.schedulerTickMs = float(self.config.param("schedulerTickMs"))
+		if self.config.param("statsIntervalSecs") is not None:
+			self.statsIntervalSecs = float(self.config.param("statsIntervalSecs"))
+		if self.config.param("engine") is not None:
+			self.engine = self.config.param("engine")
+
+		# resolved configuration snapshot; everything after
+		# startup reads these rather than config.param
+		self.settings = self.resolveSettings()
+		self.clientName = self.settings["clientName"]
+		self.clientTopics = distio_client_topics(self.clientName)
+
+		# state cache changes are coalesced and written to
+		# disk from a background thread, or from the event
+		# loop with the asyncio engine; either appended to the
+		# binary journal or as the whole JSON document
+		if self.stateStore == "journal":
+			from distio_journal import distio_state_journal
+			self.stateWriter = distio_state_journal(self.settings["stateJournalFile"], self._journalBanks,
+				self.stateCacheIntervalMs, self.stats, self.settings["stateJournalCompactRecords"])
+		else:
+			self.stateWriter = distio_cache_writer(self.settings["stateCacheFile"], self._serializeState, self.stateCacheIntervalMs, self.stats)
+		self.stateWriter.onError = self._onStateWriteError
+		if self.engine != "asyncio":
+			self.stateWriter.start()
+
+		# mainloop timers; banks must be attached before
+		# the mqttc loop can deliver commands to them
+		if self.engine == "asyncio":
+			from distio_async import distio_async_scheduler
+			self.scheduler = distio_async_scheduler(self.schedulerTickMs / 1000.0)
+		else:
+			self.scheduler = distio_scheduler(self.schedulerTickMs / 1000.0)
+		self.scheduler.onError = self._onCallbackError
+		self.statsTimer = None
+		self.stateCacheTimer = None
+		self.stateCacheFlush = None
+		for bank in self.allBanks():
+			bank._attach(self)
+
+		# Initialize state and then attemp to recover
+		# from a disk based cache. Outputs are restored
+		# before the broker is contacted at all, so relays
+		# come back after a power cycle even if it is down,
+		# and before paho is even imported
+		restored = not self.loadState()
+		self.startupMetrics["outputs_restored_ms"] = round((time.monotonic() - self.startupStart) * 1000, 3)
+
 		# Configure MQTTC Client
-		self.clientName = self.config.param("mqtt","clientName")
-		self.mqttc = paho.Client(self.clientName)
+		self.mqttc = self.createMqttClient(self.clientName)
 		self.mqttc.on_message = self._onMqttMessage
 		self.mqttc.on_connect = self._onMqttConnect
 		self.mqttc.on_publish = self._onMqttPublish
 		self.mqttc.on_subscribe = self._onMqttSubscribe
+		self.mqttc.on_disconnect = self._onMqttDisconnect
+
+		# IO publishes are held here while the broker is
+		# unreachable and replayed on reconnect
+		self.outbox = distio_outbox.fromConfig(self.mqttc, self.scheduler, self.settings["offlineQueue"], self.stats)
+		if self.engine == "asyncio":
+			from distio_async import distio_async_mqtt
+			self.mqttIo = distio_async_mqtt(self.mqttc, self.scheduler,
+				reconnectMinSecs=self.settings["reconnectMinSecs"], reconnectMaxSecs=self.settings["reconnectMaxSecs"])
 
 		# Set MQTT Last Will and Testament to maintain
 		# client status tracking
 		# maintained during on_connect callback also
 		if self.debugEnabled:
-			print("Connecting to MQTT Broker at {0}:{1}".format(self.config.param("mqtt","remoteHost"), self.config.param("mqtt","remotePort")))
-		self.mqttc.will_set("clients/{0}/status".format(self.config.param("mqtt","clientName")), 'offline', QOS_AT_LEAST_ONCE, True)
-		self.mqttc.connect(self.config.param("mqtt","remoteHost"), self.config.param("mqtt","remotePort"))
-		
-		# Initialize state and then attemp to recover
-		# from a disk based cache. This should be called
-		# before mqttc loop begins
-		self.loadState()
+			print("Connecting to MQTT Broker at {0}:{1}".format(self.settings["remoteHost"], self.settings["remotePort"]))
+		self.mqttc.will_set(self.clientTopics.status, PAYLOAD_OFFLINE, QOS_AT_LEAST_ONCE, True)
+
+		# connect in the background; paho's network thread
+		# (or the asyncio engine) retries with exponential
+		# backoff while the broker is unreachable
+		self.mqttc.reconnect_delay_set(self.settings["reconnectMinSecs"], self.settings["reconnectMaxSecs"])
+		self.mqttc.connect_async(self.settings["remoteHost"], self.settings["remotePort"])
 		
 		# call mqttc loop to start and operate in 
-		# a dedicated thread
-		self.mqttc.loop_start()
+		# a dedicated thread, or on the event loop
+		if self.engine == "asyncio":
+			self.mqttIo.start()
+		else:
+			self.mqttc.loop_start()
 
 		# we are not yet resuming continuous pulsing
 		# outputs from persistent state cache from disk
-		self.inputStateCheck = []
-		self.dioOutputPulse = []
-		for i in range(self.num_dio_outputs):
-			self.dioOutputPulse.append(distio_pulse())
 
 		# check io banks against what we expect them to be
-		self.pollInputs()
+		changed = not restored
+		for bank in self.allBanks():
+			inputs = bank.state.inputs.state
+			bank.pollInputs()
+			changed = changed or (bank.state.inputs.state != inputs)
 		
-		# we have syncronized, so cache our state
-		self.writeStateCache()
+		# we have syncronized, so cache our state if that
+		# changed anything
+		if changed:
+			self.writeStateCache()
+
+		# mirror state for same-host readers once it is known
+		if self.settings["stateSegment"] is not None:
+			self._openStateSegment(self.settings["stateSegment"])
 
 		# begin listeners and other operations in subclass
-		self.start()
+		for bank in self.allBanks():
+			bank.start()
 
 		# automatically begin mainloop unless
 		# directed otherwise in reimplemented init() method
@@ -132,93 +306,148 @@ class distio_client():
 				print("Received keyboard interrupt.  Shutting down..")
 
 
-	#
-	# STUB METHODS for reimplementation 
-	# in subclasses
-	#
-	def init():
-		pass
-		
-	def start():
-		pass
-		
-	def setDigitalOutput(self, channel, value, quiet = False):
-		return True
-		
-	def setDigitalInputPullup(self, channel, value):
-		return True
-		
-	def readDigitalInput(self, channel):
-		return True
-
+	# configuration as used by the client once started; a
+	# plain dict so it may be inspected or published as is
+	def resolveSettings(self):
+		settings = {}
+		settings["clientName"] = self.config.param("mqtt","clientName")
+		settings["remoteHost"] = self.config.param("mqtt","remoteHost")
+		settings["remotePort"] = self.config.param("mqtt","remotePort")
+		settings["reconnectMinSecs"] = float(self.config.param("mqtt","reconnectMinSecs") or 1)
+		settings["reconnectMaxSecs"] = float(self.config.param("mqtt","reconnectMaxSecs") or 60)
+		settings["stateCacheFile"] = self.config.param("stateCacheFile")
+		settings["stateStore"] = self.stateStore
+		settings["offlineQueue"] = self.config.param("offlineQueue") or {}
+		settings["stateSegment"] = self.config.param("stateSegment")
+		settings["stateJournalFile"] = self.config.param("stateJournalFile") or \
+			"{0}.journal".format(os.path.splitext(settings["stateCacheFile"])[0])
+		settings["stateJournalCompactRecords"] = int(self.config.param("stateJournalCompactRecords") or 4096)
+		settings["engine"] = self.engine
+		settings["inputPollIntervalMs"] = self.inputPollIntervalMs
+		settings["stateCacheIntervalMs"] = self.stateCacheIntervalMs
+		settings["schedulerTickMs"] = self.schedulerTickMs
+		settings["statsIntervalSecs"] = self.statsIntervalSecs
+		return settings
+
+	# mqtt client construction; reimplement to substitute a
+	# compatible client (eg. a simulated broker). paho is
+	# imported here so adapters supplying their own client (and
+	# startup up to the output restore) never pay for it
+	def createMqttClient(self, clientName):
+		import paho.mqtt.client as paho
+		return paho.Client(clientName)
+
+	# register an additional IO bank; call from init(). The
+	# bank name becomes part of its topics, so it may not
+	# contain /, + or #, and must not collide with an io-class
+	# name (eg. "dio-output") or a client level topic (get,
+	# response, interlock)
+	def addBank(self, bank):
+		if not validTopicLevel(bank.bankName):
+			raise ValueError("invalid bank name {0}".format(bank.bankName))
+		if bank.bankName in RESERVED_BANK_NAMES:
+			raise ValueError("bank name {0} is reserved".format(bank.bankName))
+		self.banks[bank.bankName] = bank
+		bank.client = self
+		bank.init()
+		return bank
+
+	# the client's own bank followed by registered banks
+	def allBanks(self):
+		return [self] + list(self.banks.values())
+
+	# formerly _onMqttConnect(self, mosq, obj, flags, rc):
 	def _onMqttConnect(self, *args, **kwargs):
-		self.mqttc.subscribe("io/{0}/+/+/set/#".format(self.config.param("mqtt","clientName")), QOS_EXACTLY_ONCE)
-		self.mqttc.publish("clients/{0}/status".format(self.config.param("mqtt","clientName")), 'online', QOS_AT_LEAST_ONCE, True)
+
+		# connection refused by the broker
+		if (len(args) > 3) and args[3] != 0:
+			return
+
+		if "online_ms" not in self.startupMetrics:
+			self.startupMetrics["online_ms"] = round((time.monotonic() - self.startupStart) * 1000, 3)
+			self.writeLog("startup: outputs restored in {0} ms, online in {1} ms".format(
+				self.startupMetrics["outputs_restored_ms"], self.startupMetrics["online_ms"]), "info")
+		self._buildCommandRoutes()
+		self.mqttc.subscribe("io/{0}/+/+/set/#".format(self.clientName), QOS_EXACTLY_ONCE)
+		if self.banks:
+			self.mqttc.subscribe("io/{0}/+/+/+/set/#".format(self.clientName), QOS_EXACTLY_ONCE)
+		self.mqttc.subscribe(self.clientTopics.getPrefix + "#", QOS_AT_LEAST_ONCE)
+		self.mqttc.publish(self.clientTopics.status, PAYLOAD_ONLINE, QOS_AT_LEAST_ONCE, True)
+		self.outbox.setConnected(True)
+
+	def _onMqttDisconnect(self, *args, **kwargs):
+		self.outbox.setConnected(False)
+
+	# Command routing table
+	# Subclasses may register further verbs by extending
+	# this method and calling self.commandRouter.add()
+	def _buildCommandRoutes(self):
+		self.commandRouter = distio_router("io/{0}".format(self.clientName))
+		for bank in self.allBanks():
+			bank._addCommandRoutes(self.commandRouter)
 
 	def _onMqttMessage(self, *args, **kwargs):
 
 		# will it always be 2?
 		msg = args[2]
+		message = msg.payload.decode("utf-8")
+
+		self.commandReceived = time.monotonic()
+		self.stats.count("commands")
+
+		if msg.topic.startswith(self.clientTopics.getPrefix):
+			self._onGetCommand(msg.topic[len(self.clientTopics.getPrefix):], message)
+			return
+
+		if self.commandRouter.dispatch(msg.topic, message):
+			# error, unrecognized command
+			self.writeLog("unrecognized command \"{0}\" -> \"{1}\" received; ignoring".format(msg.topic, message), "error")
+
+	# state queries; the payload is a correlation id echoed in
+	# the response, or a json object with "correlation_id" and
+	# optionally "response_topic" and "banks" (names to include,
+	# "" for the client's own bank)
+	def _onGetCommand(self, query, message):
+		if query != "snapshot":
+			self.writeLog("unrecognized query \"{0}\" -> \"{1}\" received; ignoring".format(query, message), "error")
+			return True
 
-		# dio-output set parameter
-		# Valid Parameters:
-		# state - set output state (on/off, etc)
-		# mode - Set output mode, (open_collector, logic, etc)
-		# pulse - Start pulse patten
-		match = re.search("io/{0}/dio-output/([0-9]*)/set/([0-9A-Za-z]*)".format(self.config.param("mqtt","clientName")), msg.topic)
-		if match:
-		
-			channel = int(match.group(1))
-			message = msg.payload.decode("utf-8")
-			
-			if (channel < 0) or (channel >= self.num_dio_outputs):
-				self.writeLog("specified channel ({0}) is not within range of 0-{1}".format(channel, (self.num_dio_outputs-1)), "error")
-
-			if match.group(2).lower() == "state":
-				self._setDigitalOutput(channel, message)
-				if self.debugEnabled:
-					print("set state ch {0} to {1}".format(channel, message))
-
-			# Pulse output
-			# Length of ON
-			# Length of OFF
-			# Repetitions
-			# Time Off Between = 0
-			elif match.group(2).lower() == "pulse":
-				
-				# Return if we do not have arguments
-				if not len(message):
-					self.writeLog("pulse command requires arguments \"{0}\"".format(msg.topic), "error")
-					return True
-				
-				arguments = []
-				if ',' in message: arguments = str(message).split(",")
-				else: arguments.append(message)
-
-				# Proceed with Pulse Call
-				if not self.dioOutputPulse[channel].pulse(arguments):
-					# Turn DIO Channel ON quietly
-					self._setDigitalOutput(channel, 1, True)
-				else:
-					self.writeLog("failed to pulse output channel \"{0}\"; bad arguments".format(channel), "error")
-			
-			else:
-				# error, unrecognized command
-				self.writeLog("unrecognized command \"{0}\" -> \"{1}\" received; ignoring".format(msg.topic, message), "error")
-
-		# dio-output pullup set
-		match = re.search("io/{0}/dio-input/([0-9]*)/pullup/set/([0-9A-Za-z]*)".format(self.config.param("mqtt","clientName")), msg.topic)
-		if match:
-
-			if match.group(2).lower() == "pullup":
-				self._setDigitalInputPullup(match.group(1), message)
-
-		# dio-output set mode
-		# gpio
-		# open collector
-		# tri-state
-
-		# dio-output pulse
+		request = {"correlation_id": message}
+		if message.startswith("{"):
+			try:
+				request = json.loads(message)
+			except ValueError:
+				request = None
+		if not isinstance(request, dict):
+			self.writeLog("snapshot request \"{0}\" is not a json object".format(message), "error")
+			return True
+
+		# the response topic and bank filter come from the
+		# network; a wildcard topic would make paho raise on
+		# the mainloop
+		if ("response_topic" in request) and not validPublishTopic(request["response_topic"]):
+			self.writeLog("snapshot response_topic {0!r} is not a valid topic".format(request["response_topic"]), "error")
+			return True
+		if ("banks" in request) and not isinstance(request["banks"], list):
+			self.writeLog("snapshot banks must be a list of bank names", "error")
+			return True
+
+		# bank state belongs to the mainloop
+		self.scheduler.callSoon(self._publishSnapshot, request)
+
+	def _publishSnapshot(self, request):
+		names = request.get("banks")
+		response = {}
+		response["correlation_id"] = request.get("correlation_id")
+		response["time"] = round(time.time(), 3)
+		response["banks"] = {}
+		for bank in self.allBanks():
+			name = bank.bankName or ""
+			if (names is None) or (name in names):
+				response["banks"][name] = bank.snapshot()
+		self.outbox.publish(request.get("response_topic", self.clientTopics.snapshotResponse),
+			json.dumps(response, separators=(",", ":")), QOS_AT_LEAST_ONCE)
+		self.stats.count("snapshot_requests")
 
 	# formerly _onMqttPublish(self, mosq, obj, mid):
 	def _onMqttPublish(self, *args, **kwargs):
@@ -229,225 +458,246 @@ class distio_client():
 	    pass
 
 	def writeLog(self, message, level="debug"):
-		self.mqttc.publish("log/{0}/{1}".format(self.config.param("mqtt","clientName"),level), message, QOS_AT_MOST_ONCE)
+
+		# banks are attached before the mqtt client exists
+		if self.mqttc is None:
+			print("{0}: {1}".format(level, message))
+			return
+
+		topic = self.clientTopics.log.get(level)
+		if topic is None:
+			topic = self.clientTopics.logPrefix + level
+		self.mqttc.publish(topic, message, QOS_AT_MOST_ONCE)
+
+	# mainloop; a timer or tick callback raised
+	def _onCallbackError(self, callback, error):
+		self.stats.count("callback_errors")
+		self.writeLog("{0} failed: {1!r}".format(getattr(callback, "__qualname__", callback), error), "error")
+		if self.debugEnabled:
+			traceback.print_exception(type(error), error, error.__traceback__)
+
+	# writer thread (or executor); retried every interval
+	# until a write succeeds
+	def _onStateWriteError(self, error):
+		self.writeLog("unable to write state to {0}: {1}".format(self.stateWriter.path, error), "error")
 
 	def loadState(self):
 
 		# init state first so we can append or otherwise
 		# default if a state is not available to load
-		self.initState()
+		for bank in self.allBanks():
+			bank.initState()
+
+		# the journal is replayed into the JSON cache layout;
+		# without one (first start or after switching from the
+		# json store) the JSON cache is imported
+		cache = None
+		if self.stateStore == "journal":
+			cache = self.stateWriter.recover()
+			if cache is not None:
+				self.writeLog("recovered state journal from disk")
+		if cache is None:
+			cache = self._loadJsonCache()
+
+		# the default bank keeps the original cache layout
+		# with additional banks nested under "banks"
+		if cache is not None:
+			self.restoreState(cache)
+			banks = cache.get("banks", {})
+			for name in self.banks:
+				if name in banks:
+					self.banks[name].restoreState(banks[name])
+
+		# continue the journal from the restored state; it
+		# is only rewritten when it cannot be appended to
+		if self.stateStore == "journal":
+			self.stateWriter.resume()
+
+		return cache is None
+
+	def _loadJsonCache(self):
 
 		# check if stateCacheFile can be read
-		if not os.path.isfile(self.config.param("stateCacheFile")):
-			return True
+		if not os.path.isfile(self.settings["stateCacheFile"]):
+			return None
 
 		try:
-			with open(self.config.param("stateCacheFile")) as data_file:
-				self.state = json.load(data_file)
+			with open(self.settings["stateCacheFile"]) as data_file:
+				cache = json.load(data_file)
 				self.writeLog("loaded piface cached state from disk")
 		except:
-			self.writeLog("unable to process piface cached state ({0})".format(self.config.param("stateCacheFile")))
-			return True
+			self.writeLog("unable to process piface cached state ({0})".format(self.settings["stateCacheFile"]))
+			return None
+		return cache
 
-		# resume IO state and settins
-		for i in range(len(self.state["outputs"])):
-			# Quietly set Digital Outputs
-			self.setDigitalOutput(i, self.state["outputs"][i]["state"], True)
-		for i in range(len(self.state["inputs"])):
-			self.setDigitalInputPullup(i, self.state["inputs"][i]["pullup"])
-			# load cached input state; which will be 
-			# checked immediately during the mainloop
-			# this helps by creating events only for
-			# inputs which have genuinely changed and will
-			# keep noise down between process cycles
-			self.state["inputs"][i]["state"] = self.state["inputs"][i]["state"]
-
-		return False
-
-	# Write state to disk / cache
+	# Schedule state to be written to disk / cache; the
+	# write happens on the state writer thread
 	def writeStateCache(self):
-		with open(self.config.param("stateCacheFile"), 'w') as outfile:
-			json.dump(self.state, outfile, indent=1)
-
-	def initState(self):
-
-		# Build state array
-		self.state  = {}
-
-		self.state["inputs"] = []
-		
-		for i in range(self.num_dio_inputs):
-			
-			input = {}
-			self.state["inputs"].append(input)
-			
-			# default to false input state until checked later on
-			self.state["inputs"][i]["state"] = 0
-			
-			# default to internal pullups enabled for all inputs
-			# otherwise, unknowing users will be surprised with noise
-			self.state["inputs"][i]["pullup"] = 1
-			self.state["inputs"][i]["time_last_change"] = None
-
-		self.state["outputs"] = []
-		for i in range(self.num_dio_outputs):
-			output = {}
-			self.state["outputs"].append(output)
-			self.state["outputs"][i]["state"] = 0
-
-	def _setDigitalOutput(self, channel, value, quiet = False):
-
-		# check that requested channel exists
-		channel = int(channel)
-		if (channel < 0) or (channel >= self.num_dio_outputs):
-			# todo throw exception
-			self.writeLog("channel of {0} does not match 0-{1}".format(channel,self.num_dio_outputs), "error")
-			return True
-
-		# substitute supplied value
-		if (value == "on"): value = 1
-		if (value == "off"): value = 0
-		if (value == "high"): value = 1
-		if (value == "low"): value = 0
-
-		value = int(value)
-		if not ((value == 1) or (value == 0)):
-			# todo throw exception
-			self.writeLog("value of {0} does not match 0 or 1".format(value), "error")
+		self.stateWriter.markDirty()
+
+		# output commands may arrive off the mainloop, which
+		# owns the segment
+		if (self.stateSegment is not None) and not self.stateSegmentSyncPending:
+			self.stateSegmentSyncPending = True
+			self.scheduler.callSoon(self._syncStateSegment)
+
+	# shared memory mirror of every bank; input edges are
+	# picked up after each scheduler tick
+	def _openStateSegment(self, params):
+		path = params.get("file") or "/dev/shm/distio-{0}".format(self.clientName)
+		try:
+			self.stateSegment = distio_state_segment(path, self._journalBanks, int(params.get("mailboxSlots", 0)))
+		except (OSError, ValueError) as e:
+			self.writeLog("unable to create state segment {0}: {1}".format(path, e), "error")
 			return True
-
-		# pass to another method which will often
-		# be re-implemented in subclass
-		if not self.setDigitalOutput(channel, value):
-
-			# track, publish, and set state
-			# cache state to disk
-			if not quiet:
-				self.state["outputs"][channel]["state"] = value
-				self.mqttc.publish("io/{0}/dio-output/{1}/state".format(self.config.param("mqtt","clientName"), channel), value, QOS_AT_LEAST_ONCE, True)
-				self.writeStateCache()
-
-
-	def _setDigitalInputPullup(self, channel, value):
-
-		# check that requested channel exists
-		channel = int(channel)
-		if (channel < 0) or (channel >= self.num_dio_inputs):
-			# todo throw exception
+		self.scheduler.addTickHandler(self.stateSegment.sync)
+		if self.stateSegment.mailboxSlots:
+			self.scheduler.callEvery(float(params.get("mailboxPollMs", 20)) / 1000.0, self._drainStateMailbox)
+
+	def _syncStateSegment(self):
+		self.stateSegmentSyncPending = False
+		self.stateSegment.sync()
+
+	def _drainStateMailbox(self):
+		count = self.stateSegment.drainMailbox(self._onMailboxCommand, self._onMailboxOverrun)
+		if count:
+			self.stats.count("mailbox_commands", count)
+
+	def _onMailboxOverrun(self, head, tail):
+		self.stats.count("mailbox_overruns")
+		self.writeLog("state segment mailbox head {0} is not within {1} slots of tail {2}; resynchronized".format(
+			head, self.stateSegment.mailboxSlots, tail), "error")
+
+	# output command from a same-host process; see distio_segment
+	def _onMailboxCommand(self, index, op, channel, mask, value, arguments):
+		banks = self.allBanks()
+		if index >= len(banks):
 			return True
+		bank = banks[index]
+		if op == MAILBOX_OUTPUT_STATE:
+			return bank._setDigitalOutput(channel, value)
+		if op == MAILBOX_OUTPUT_BANK:
+			return bank._setDigitalOutputs(mask, value)
+		if op == MAILBOX_OUTPUT_PULSE:
+			if bank._commandChannel(channel, bank.num_dio_outputs) is None:
+				return True
+			return bank._startPulse(channel, arguments.split(","))
+		self.writeLog("unrecognized mailbox command {0}".format(op), "error")
+		return True
 
-		# substitute supplied value
-		if (value == "on"): value = 1
-		if (value == "off"): value = 0
-		if (value == "high"): value = 1
-		if (value == "low"): value = 0
+	# banks for the state journal, the default bank first
+	def _journalBanks(self):
+		banks = [(None, self.state)]
+		for name in self.banks:
+			banks.append((name, self.banks[name].state))
+		return banks
+
+	def _serializeState(self):
+		cache = self.state.toCache()
+		if self.banks:
+			cache["banks"] = {}
+			for name in self.banks:
+				cache["banks"][name] = self.banks[name].state.toCache()
+		return json.dumps(cache, indent=1)
+
+	def _recordCommandLatency(self, received):
+		if received is not None:
+			self.stats.record("command_latency_ms", (time.monotonic() - received) * 1000)
+
+	# periodic stats snapshot; counters and histograms cover
+	# the interval since the previous snapshot
+	def publishStats(self):
+		snapshot = self.stats.snapshot()
+		snapshot["startup"] = self.startupMetrics
+		snapshot["outbox"] = {
+			"pending_state": len(self.outbox.state),
+			"pending_events": len(self.outbox.events),
+			"spool_bytes": self.outbox.spoolBytes,
+			"dropped": self.outbox.dropped,
+		}
+		snapshot["input_polling"] = {}
+		for bank in self.allBanks():
+			if bank.digitalInputPollingEnabled and bank.inputPoller.polls:
+				snapshot["input_polling"][bank.bankName or ""] = {
+					"cost_ms": round(bank.inputPoller.costMs, 4),
+					"interval_ms": round(bank.inputPoller.intervalSecs * 1000, 3),
+					"polls": bank.inputPoller.polls,
+				}
+		snapshot["input_rings"] = {}
+		for bank in self.allBanks():
+			snapshot["input_rings"][bank.bankName or ""] = {
+				"depth": len(bank.inputEvents),
+				"high_water": bank.inputEvents.highWater,
+				"overflows": bank.inputEvents.overflows,
+			}
+		self.mqttc.publish(self.clientTopics.stats, json.dumps(snapshot), QOS_AT_MOST_ONCE)
 
-		value = int(value)
+	def run(self):
+		try:
+			if self.debugEnabled:
+				print("starting ::run() mainloop")
 
-		if not (value == 1) or (value == 0):
-			self.writeLog("value of {0} does not match 0 or 1".format(value), "error")
-			return True
+			# inputs are polled at an adaptive rate (see
+			# distio_poller) and analog inputs sampled in blocks
+			# (see distio_analog); outputs pulse from their own
+			# timers. With none of these the mainloop blocks
+			# until an mqtt command arrives
+			for bank in self.allBanks():
+				if bank.digitalInputPollingEnabled:
+					bank.inputPoller.start()
+				bank.startAnalogInputs()
 
-		# pass to another method which will often
-		# be re-implemented in subclass
-		if not self.setDigitalInputPullup(channel, value):
+			if self.statsIntervalSecs > 0:
+				self.statsTimer = self.scheduler.callEvery(self.statsIntervalSecs, self.publishStats)
 
-			# track, publish, and set state
-			# cache state to disk
-			self.state["inputs"][channel]["pullup"] = value
-			self.mqttc.publish("io/{0}/dio-input/{1}/pullup".format(self.config.param("mqtt","clientName"), channel), value, QOS_AT_LEAST_ONCE, True)
+			if self.engine == "asyncio":
+				self.stateCacheTimer = self.scheduler.callEvery(self.stateCacheIntervalMs / 1000.0, self._flushStateCache)
+				self._addSignalHandlers()
 
-			self.writeStateCache()
-		
-	def pollInputs(self):
-		
-		# time this io bank poll for performance
-		if self.inputPollTimeMs is 0:
-			timeStart = time.time()
-
-		# Iterate inputs and check against previously
-		# known state, detecting changes
-		for i in range(len(self.inputStateCheck)):
-			inputState = self.readDigitalInput[i]
-			if inputState != self.state["inputs"][i]["state"]:
-				if self.debugEnabled:
-					print("input ch{0} changed from {1} to {2}".format(i, inputState, self.state["inputs"][i]["state"]))
-				self.state["inputs"][i]["state"] = inputState
-				self.mqttc.publish("io/{0}/dio-input/{1}/state".format(self.config.param("mqtt","clientName"), i), inputState, QOS_AT_LEAST_ONCE, True)
-
-		if self.inputPollTimeMs is 0:
-			self.inputPollTimeMs = (time.time() - timeStart) * 1000
-			self.writeLog("input bank poll time is {:.2f} milliseconds".format(self.inputPollTimeMs), "debug")
-	
-	# digitalInputChanged(channel, new state, timestamp elapsed seconds)
-	# Called from subclass, generally after an interrupt was
-	# generated.  Could be called as a result of polling within
-	# a subclass also
-	def digitalInputChanged(self, channel, state, timestamp):
-	
-		# do we in fact have an input transition event	
-		if self.state["inputs"][channel]["state"] != state:
-			
-			# build an event object
-			event = {}
-			event["value_new"] = state
-			event["value_old"] = self.state["inputs"][channel]["state"]
-			
-			# calculate elapsed time since last transition event
-			# convert to milliseconds and round to nearest whole millisecond
-			if "time_last_change" in self.state["inputs"][channel]:
-				if self.state["inputs"][channel]["time_last_change"] is not None:
-					event["time_elapsed"] = round((time.time() - self.state["inputs"][channel]["time_last_change"]) * 1000)
-				
-			# timestamp current event
-			event["time_event"] = time.time()
-		
-			if self.debugEnabled:
-				print("input ch{0} changed from {1} to {2}".format(channel, self.state["inputs"][channel]["state"], state))
-				
-			self.state["inputs"][channel]["state"] = state
-			self.mqttc.publish("io/{0}/dio-input/{1}/state".format(self.config.param("mqtt","clientName"), channel), state, QOS_AT_LEAST_ONCE, True)
-			
-			# determine event transition type
-			if state: input_transition_direction = "rise"
-			else: input_transition_direction = "fall"
-			
-			# send JSON event
-			self.mqttc.publish("io/{0}/dio-input/{1}/event/transition/{2}".format(self.config.param("mqtt","clientName"), channel, input_transition_direction), json.dumps(event))
-			
-			# store this event for calculation of event duraction
-			self.state["inputs"][channel]["time_last_change"] = time.time()
+			self.scheduler.run()
 
-	def run(self):
-		running = True
-		loop_count = 0
-		try:
-			if self.debugEnabled:
-				print("starting ::run() mainloop")
-				
-			while running:
-				
-				if self.digitalInputPollingEnabled:
-					self._pollInputs()
-				
-				# Process Output Pulses
-				for i in range(self.num_dio_outputs):
-					if self.dioOutputPulse[i].process():
-						self._setDigitalOutput(i, self.dioOutputPulse[i].outputRequest, True)
-						self.dioOutputPulse[i].outputRequest = None
-				
-				# sleep during main loop unless it was
-				# found that input bank polling takes 
-				# longer than one msec
-				if self.inputPollTimeMs > 1:
-					time.sleep(0.001) # in mS
-				
 		except KeyboardInterrupt:
+			pass
+
+		finally:
+			# final flush of any pending state
 			self.writeStateCache()
-			running = False
+			self.stateWriter.stop()
+			if self.stateSegment is not None:
+				self.stateSegment.close()
+
+	def stop(self):
+		self.scheduler.stop()
+
+	# asyncio engine; clean shutdown awaitable from the loop
+	# asyncio engine; the write, fsync and directory fsync
+	# block, so they run in the loop's executor rather than
+	# stalling timers, and at most one flush is in flight
+	def _flushStateCache(self):
+		if (self.stateCacheFlush is not None) and not self.stateCacheFlush.done():
+			return
+		if self.stateWriter.dirty:
+			self.stateCacheFlush = self.scheduler.loop.run_in_executor(None, self.stateWriter.flush)
+
+	async def shutdown(self):
+		self.mqttc.publish(self.clientTopics.status, PAYLOAD_OFFLINE, QOS_AT_LEAST_ONCE, True)
+		self.writeStateCache()
+		await self.scheduler.loop.run_in_executor(None, self.stateWriter.flush)
+		self.mqttIo.stop()
+		self.mqttc.disconnect()
+		self.stop()
+
+	def _addSignalHandlers(self):
+		import signal
+		for signum in (signal.SIGINT, signal.SIGTERM):
+			try:
+				self.scheduler.loop.add_signal_handler(signum, lambda: self.scheduler.loop.create_task(self.shutdown()))
+			except (NotImplementedError, RuntimeError, ValueError):
+				# not the main thread or unsupported platform
+				pass
 
 
 
 
 class distio_input():
-	pass
\ No newline at end of file
+	pass
@@ -0,0 +1,40 @@
+# distio_clock
+#
+# Time base for the event pipeline
+#
+# Durations, pulse deadlines and input event timestamps are all
+# monotonic seconds, the same clock the schedulers run on, so
+# NTP steps and manual clock changes neither stretch pulses nor
+# corrupt the interval between edges. Wall clock (epoch) time is
+# used only for presentation (published event times) and for
+# persistence (the state cache), converted with toWall() and
+# fromWall().
+#
+# Input capture times may arrive on either clock: adapters
+# written before this time base pass epoch seconds, and
+# fromCapture() tells the two apart by magnitude. Monotonic
+# time counts from boot and stays far below WALL_MIN, the
+# epoch time in 2001, for decades of uptime.
+#
+
+import time
+
+# monotonic seconds
+now = time.monotonic
+
+# monotonic timestamp to epoch seconds
+def toWall(timestamp):
+	return timestamp + (time.time() - time.monotonic())
+
+# epoch seconds (eg. a capture time from a hardware library)
+# to a monotonic timestamp
+def fromWall(timestamp):
+	return timestamp - (time.time() - time.monotonic())
+
+WALL_MIN = 1e9
+
+# an edge capture time in either clock to a monotonic timestamp
+def fromCapture(timestamp):
+	if timestamp >= WALL_MIN:
+		return fromWall(timestamp)
+	return timestamp
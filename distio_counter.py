@@ -0,0 +1,109 @@
+# distio_counter
+#
+# Edge counting and frequency inputs
+#
+# An input configured as a counter does not publish state and
+# transition messages per edge. Its edges are counted locally
+# and the period between counted edges measured; a summary is
+# published on
+#
+# io/{client-name}/dio-input/{channel}/counter [json, retained]
+#
+# every publishIntervalSecs, or as soon as publishDelta edges
+# have been counted since the last publish, so broker traffic
+# does not depend on the pulse rate. The summary holds:
+#
+# - count: running total, persisted in the state cache
+# - rate_hz: counted edges per second since the previous publish
+# - period_ms / frequency_hz: time between the last two counted
+#   edges (absent once edges stop)
+#
+# Counters are configured per channel with the "inputCounters"
+# config object; defaults may be given alongside "channels":
+#
+# "inputCounters": {
+#     "publishIntervalSecs": 10,
+#     "channels": {"2": {"edge": "rise", "publishDelta": 500}}
+# }
+#
+# edge selects the counted transitions: rise, fall or both.
+#
+# Counter inputs skip the bank's default debounce profile so no
+# edges are lost; give the channel its own "inputDebounce" entry
+# if the contact needs one.
+#
+
+class distio_edge_counter():
+
+	__slots__ = ("edge", "intervalSecs", "delta", "lastEdge", "periodSecs",
+		"publishedCount", "publishedTime", "publishedRate", "timer")
+
+	EDGES = ("rise", "fall", "both")
+
+	def __init__(self, edge="rise", publishIntervalSecs=10, publishDelta=0):
+		if edge not in self.EDGES:
+			raise ValueError("unknown counter edge \"{0}\"".format(edge))
+		self.edge = edge
+		self.intervalSecs = publishIntervalSecs
+		self.delta = publishDelta
+
+		self.lastEdge = None
+		self.periodSecs = None
+		self.publishedCount = None
+		self.publishedTime = None
+		self.publishedRate = None
+		self.timer = None
+
+	@classmethod
+	def fromConfig(cls, params):
+		return cls(str(params.get("edge", "rise")).lower(), float(params.get("publishIntervalSecs", 10)),
+			int(params.get("publishDelta", 0)))
+
+	# count a debounced transition into the channel record;
+	# returns True if the change threshold calls for a publish
+	def count(self, record, level, timestamp):
+
+		if ((self.edge == "rise") and not level) or ((self.edge == "fall") and level):
+			return False
+
+		record.count = (record.count or 0) + 1
+		if self.lastEdge is not None:
+			self.periodSecs = timestamp - self.lastEdge
+		self.lastEdge = timestamp
+
+		return (self.delta > 0) and (record.count - (self.publishedCount or 0) >= self.delta)
+
+	# discard measurements, eg. after the total is preset
+	def restart(self):
+		self.lastEdge = None
+		self.periodSecs = None
+		self.publishedCount = None
+		self.publishedTime = None
+		self.publishedRate = None
+
+	# something new to report since the last summary
+	def due(self, record):
+		return ((record.count or 0) != self.publishedCount) or bool(self.publishedRate)
+
+	# build the summary and start a new measurement interval
+	def summary(self, record, now):
+
+		count = record.count or 0
+		summary = {}
+		summary["count"] = count
+
+		if (self.publishedCount is not None) and (now > self.publishedTime):
+			rate = (count - self.publishedCount) / (now - self.publishedTime)
+			summary["rate_hz"] = round(rate, 4)
+		else:
+			rate = None
+
+		# instantaneous period only while edges keep coming
+		if (self.periodSecs is not None) and (count != self.publishedCount) and (self.periodSecs > 0):
+			summary["period_ms"] = round(self.periodSecs * 1000, 3)
+			summary["frequency_hz"] = round(1.0 / self.periodSecs, 4)
+
+		self.publishedCount = count
+		self.publishedTime = now
+		self.publishedRate = rate
+		return summary
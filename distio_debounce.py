@@ -0,0 +1,157 @@
+# distio_debounce
+#
+# Software input debounce
+#
+# Raw input edges, whether from an interrupt listener or from
+# pollInputs, pass through a per-channel debounce profile before
+# they become state changes and MQTT traffic. All algorithms are
+# driven by the client scheduler on the mainloop:
+#
+#  - lockout: the first edge is accepted immediately and further
+#    edges are ignored for timeMs; if the input settled on the
+#    other level meanwhile that level is accepted at the end of
+#    the lockout. Lowest latency, suits fast clean inputs.
+#  - stable: a level is accepted once the input has held it for
+#    timeMs without another edge. Rejects noise and glitches
+#    shorter than the window.
+#  - integrating: a counter sampled every sampleMs counts up
+#    while the input is high and down while low, between 0 and
+#    count (default timeMs / sampleMs); the output follows only
+#    when the counter saturates. Tolerates intermittent contact
+#    on mechanical switches.
+#  - none: edges pass straight through (the default).
+#
+# An accepted level keeps the capture timestamp of the raw edge
+# which produced it, so event intervals are not skewed by the
+# debounce window.
+#
+# Profiles are configured with the "inputDebounce" config object;
+# per-channel entries override the defaults:
+#
+# "inputDebounce": {
+#     "algorithm": "stable", "timeMs": 20,
+#     "channels": {"3": {"algorithm": "lockout", "timeMs": 2}}
+# }
+#
+
+class distio_debounce_profile():
+
+	__slots__ = ("algorithm", "windowSecs", "sampleSecs", "count")
+
+	ALGORITHMS = ("none", "lockout", "stable", "integrating")
+
+	def __init__(self, algorithm="none", timeMs=0, sampleMs=1, count=None):
+		if algorithm not in self.ALGORITHMS:
+			raise ValueError("unknown debounce algorithm \"{0}\"".format(algorithm))
+		self.algorithm = algorithm
+		self.windowSecs = timeMs / 1000.0
+		self.sampleSecs = max(sampleMs, 0.1) / 1000.0
+		if count is None:
+			count = int(round(timeMs / max(sampleMs, 0.1)))
+		self.count = max(1, int(count))
+
+		# a zero window disables the time based algorithms
+		if (algorithm in ("lockout", "stable")) and (self.windowSecs <= 0):
+			self.algorithm = "none"
+
+	@classmethod
+	def fromConfig(cls, params):
+		count = params.get("count")
+		if count is not None:
+			count = int(count)
+		return cls(str(params.get("algorithm", "none")).lower(), float(params.get("timeMs", 0)),
+			float(params.get("sampleMs", 1)), count)
+
+	def enabled(self):
+		return self.algorithm != "none"
+
+class distio_debounce_channel():
+
+	__slots__ = ("profile", "raw", "rawTime", "integrator", "timer")
+
+	def __init__(self, profile):
+		self.profile = profile
+		self.raw = None
+		self.rawTime = None
+		self.integrator = 0
+		self.timer = None
+
+# level(channel) returns the debounced (published) level of a
+# channel and accept(channel, level, timestamp) is called when a
+# new level passes the debounce; mainloop only
+class distio_debouncer():
+
+	def __init__(self, scheduler, profiles, level, accept):
+		self.scheduler = scheduler
+		self.level = level
+		self.accept = accept
+		self.channels = [distio_debounce_channel(profile) for profile in profiles]
+
+	# feed a raw edge
+	def edge(self, channel, level, timestamp):
+
+		record = self.channels[channel]
+		algorithm = record.profile.algorithm
+		if algorithm == "none":
+			self.accept(channel, level, timestamp)
+			return
+
+		# pollers report a pending level on every poll; only
+		# genuine raw transitions restart the algorithms
+		if level == record.raw:
+			return
+		record.raw = level
+		record.rawTime = timestamp
+
+		if algorithm == "lockout":
+			if record.timer is None and level != self.level(channel):
+				self._lockout(channel, record)
+
+		elif algorithm == "stable":
+			if record.timer is not None:
+				self.scheduler.cancel(record.timer)
+				record.timer = None
+			if level != self.level(channel):
+				record.timer = self.scheduler.callAt(timestamp + record.profile.windowSecs, self._stableExpired, channel)
+
+		elif algorithm == "integrating":
+			if record.timer is None:
+				record.integrator = record.profile.count if self.level(channel) else 0
+				record.timer = self.scheduler.callEvery(record.profile.sampleSecs, self._integrate, channel)
+
+	def _lockout(self, channel, record):
+		self.accept(channel, record.raw, record.rawTime)
+		record.timer = self.scheduler.callAt(record.rawTime + record.profile.windowSecs, self._lockoutExpired, channel)
+
+	def _lockoutExpired(self, channel):
+		record = self.channels[channel]
+		record.timer = None
+		if record.raw != self.level(channel):
+			self._lockout(channel, record)
+
+	def _stableExpired(self, channel):
+		record = self.channels[channel]
+		record.timer = None
+		if record.raw != self.level(channel):
+			self.accept(channel, record.raw, record.rawTime)
+
+	def _integrate(self, channel):
+
+		record = self.channels[channel]
+		if record.raw:
+			record.integrator = min(record.profile.count, record.integrator + 1)
+		else:
+			record.integrator = max(0, record.integrator - 1)
+
+		level = self.level(channel)
+		if record.integrator == record.profile.count and not level:
+			level = 1
+			self.accept(channel, 1, record.rawTime)
+		elif record.integrator == 0 and level:
+			level = 0
+			self.accept(channel, 0, record.rawTime)
+
+		# stop sampling once settled
+		if (record.raw == level) and (record.integrator == (record.profile.count if level else 0)):
+			self.scheduler.cancel(record.timer)
+			record.timer = None
@@ -0,0 +1,174 @@
+# distio_interlock
+#
+# Local input to output interlock rules
+#
+# Rules are declared in the config and evaluated by the client
+# in its input event path, right after a debounced input edge is
+# applied to the bank state and before anything is published, so
+# a reaction needs no broker round trip. Each rule has
+#
+#  - trigger: an input edge, {"input": 3, "edge": "fall"}
+#    (edge is rise, fall or both)
+#  - when (optional): a condition on the bank state at the time
+#    of the edge; {"input": n, "state": 0|1}, {"output": n,
+#    "state": 0|1} combined with {"all": [...]}, {"any": [...]}
+#    and {"not": {...}}
+#  - actions: {"output": n} with one of "set": 0|1, "toggle": true
+#    or "pulse": "on_ms,off_ms,..." (as the pulse command), and
+#    an optional "delayMs" to run it later on the scheduler
+#
+# "interlocks": [
+#     {"name": "doorbell", "trigger": {"input": 3, "edge": "fall"},
+#      "when": {"not": {"input": 0, "state": 1}},
+#      "actions": [{"output": 5, "pulse": "500"},
+#                  {"output": 6, "set": 0, "delayMs": 2000}]}
+# ]
+#
+# Rules are configured per bank and refer to that bank's
+# channels. Conditions and actions are compiled once into
+# closures over the state bitmasks. Each firing is published on
+#
+# io/{client-name}/interlock/{name}/event [json]
+#
+# so rule names may not contain /, + or #.
+#
+
+from distio_topics import validTopicLevel
+
+class distio_interlock_rule():
+
+	__slots__ = ("name", "trigger", "edges", "condition", "actions", "topic")
+
+	def __init__(self, name, trigger, edges, condition, actions, topic):
+		self.name = name
+		self.trigger = trigger
+		self.edges = edges
+		self.condition = condition
+		self.actions = actions
+		self.topic = topic
+
+class distio_interlocks():
+
+	EDGES = {"rise": (1,), "fall": (0,), "both": (0, 1)}
+
+	def __init__(self, bank):
+
+		self.bank = bank
+
+		# input channel -> rules it triggers
+		self.triggers = {}
+
+	# compile and add a rule; raises ValueError if it is invalid
+	def add(self, index, spec):
+		rule = self._compileRule(index, spec)
+		self.triggers.setdefault(rule.trigger, []).append(rule)
+		return rule
+
+	def __len__(self):
+		return sum(len(rules) for rules in self.triggers.values())
+
+	# mainloop; called with the new level once the bank state
+	# reflects the edge. Returns the rules which fired
+	def inputChanged(self, channel, level, timestamp):
+		rules = self.triggers.get(channel)
+		if rules is None:
+			return None
+		fired = [rule for rule in rules if (level in rule.edges) and ((rule.condition is None) or rule.condition())]
+		for rule in fired:
+			self._fire(rule, channel, level, timestamp)
+		return fired
+
+	def _fire(self, rule, channel, level, timestamp):
+		scheduler = self.bank.client.scheduler
+		for action, delaySecs, description in rule.actions:
+			if delaySecs > 0:
+				scheduler.callLater(delaySecs, action)
+			else:
+				action()
+		self.bank._publishInterlockEvent(rule, channel, level, timestamp)
+
+	#
+	# Compilation
+	#
+
+	def _compileRule(self, index, spec):
+
+		name = str(spec.get("name", "rule{0}".format(index)))
+		if not validTopicLevel(name):
+			raise ValueError("name \"{0}\" may not be empty or contain /, + or #".format(name))
+		trigger = spec.get("trigger", {})
+		channel = self._channel(trigger.get("input"), self.bank.num_dio_inputs, "input")
+		edge = str(trigger.get("edge", "both")).lower()
+		if edge not in self.EDGES:
+			raise ValueError("unknown edge \"{0}\"".format(edge))
+
+		condition = None
+		if "when" in spec:
+			condition = self._compileCondition(spec["when"])
+
+		actions = [self._compileAction(action) for action in spec.get("actions", [])]
+		if not actions:
+			raise ValueError("no actions")
+
+		return distio_interlock_rule(name, channel, self.EDGES[edge], condition, actions,
+			"{0}/interlock/{1}/event".format(self.bank.topicPrefix, name))
+
+	def _channel(self, value, count, ioClass):
+		try:
+			channel = int(value)
+		except (TypeError, ValueError):
+			raise ValueError("{0} channel \"{1}\" is not a number".format(ioClass, value))
+		if (channel < 0) or (channel >= count):
+			raise ValueError("{0} channel {1} is not within range of 0-{2}".format(ioClass, channel, count - 1))
+		return channel
+
+	def _compileCondition(self, spec):
+
+		bank = self.bank
+		if "all" in spec:
+			terms = [self._compileCondition(term) for term in spec["all"]]
+			return lambda: all(term() for term in terms)
+		if "any" in spec:
+			terms = [self._compileCondition(term) for term in spec["any"]]
+			return lambda: any(term() for term in terms)
+		if "not" in spec:
+			term = self._compileCondition(spec["not"])
+			return lambda: not term()
+
+		state = int(spec.get("state", 1))
+		if "input" in spec:
+			bit = 1 << self._channel(spec["input"], bank.num_dio_inputs, "input")
+			match = bit if state else 0
+			return lambda: (bank.state.inputs.state & bit) == match
+		if "output" in spec:
+			bit = 1 << self._channel(spec["output"], bank.num_dio_outputs, "output")
+			match = bit if state else 0
+			return lambda: (bank.state.outputs.state & bit) == match
+		raise ValueError("unrecognized condition {0}".format(spec))
+
+	# returns (callable, delay seconds, description)
+	def _compileAction(self, spec):
+
+		bank = self.bank
+		channel = self._channel(spec.get("output"), bank.num_dio_outputs, "output")
+		delaySecs = float(spec.get("delayMs", 0)) / 1000.0
+
+		description = {"output": channel}
+		if delaySecs > 0:
+			description["delay_ms"] = spec["delayMs"]
+
+		if "set" in spec:
+			value = int(spec["set"])
+			description["set"] = value
+			return (lambda: bank._setDigitalOutput(channel, value)), delaySecs, description
+		if spec.get("toggle"):
+			description["toggle"] = True
+			return (lambda: bank._setDigitalOutput(channel, bank.state.outputs.get(channel) ^ 1)), delaySecs, description
+		if "pulse" in spec:
+			arguments = spec["pulse"]
+			if not isinstance(arguments, list):
+				arguments = str(arguments).split(",")
+			arguments = [str(argument) for argument in arguments]
+			description["pulse"] = ",".join(arguments)
+			return (lambda: bank._startPulse(channel, list(arguments))), delaySecs, description
+		raise ValueError("action for output {0} needs set, toggle or pulse".format(channel))
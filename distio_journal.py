@@ -0,0 +1,327 @@
+# distio_journal
+#
+# Append-only binary IO state journal
+#
+# Rather than rewriting the whole JSON state document on every
+# change, each flush appends one fixed-size record per channel
+# field which changed since the previous flush:
+#
+#   bank (u8), field (u8), channel (u8), check (u8),
+#   value (i32), timestamp (f64, epoch seconds)   = 16 bytes
+#
+# Input edge counts may outgrow an i32 and are carried in the
+# f64 field instead (exact to 2^53).
+#
+# check is the low byte of the CRC32 of the record with check
+# zeroed; recovery stops at the first record which fails it, so
+# a write torn by a power cut loses only that flush.
+#
+# The file starts with a header naming the banks (record bank
+# numbers index this list; null is the client's own bank):
+#
+#   "DIOJ", version (u16), record size (u16), names length (u32),
+#   JSON list of bank names, padded to a whole record
+#
+# Once the journal holds compactRecords records it is compacted:
+# a snapshot of the current state (one record per field) is
+# written to a new file which atomically replaces the journal.
+# At startup the client appends to the recovered journal when it
+# was intact and its header names the banks being hosted;
+# otherwise (torn tail, banks added or removed, no journal) it
+# compacts once, so the header always matches.
+#
+# The changed-since baseline only moves forward once records
+# are on disk. A failed append may have left a torn record,
+# which would stop recovery there, so the next flush after an
+# error compacts instead of appending.
+#
+# Recovery maps the file with mmap and replays the records into
+# the legacy cache layout (see distio_state), so restoring state
+# is the same whether it came from the journal or an old JSON
+# cache.
+#
+
+import os
+import json
+import mmap
+import struct
+import time
+import zlib
+
+import distio_clock
+from distio_cache import distio_cache_writer
+
+JOURNAL_MAGIC = b"DIOJ"
+JOURNAL_VERSION = 1
+
+JOURNAL_HEADER = struct.Struct("<4sHHI")
+JOURNAL_RECORD = struct.Struct("<BBBBid")
+
+FIELD_OUTPUT_STATE = 1
+FIELD_INPUT_STATE = 2
+FIELD_INPUT_PULLUP = 3
+FIELD_INPUT_COUNT = 4
+
+def _packRecord(bank, field, channel, value, timestamp):
+	record = JOURNAL_RECORD.pack(bank, field, channel, 0, value, timestamp)
+	check = zlib.crc32(record) & 0xff
+	return JOURNAL_RECORD.pack(bank, field, channel, check, value, timestamp)
+
+def _packHeader(names):
+	names = json.dumps(names).encode("utf-8")
+	header = JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, JOURNAL_RECORD.size, len(names)) + names
+	padding = -len(header) % JOURNAL_RECORD.size
+	return header + (b"\0" * padding)
+
+# replay a journal into the legacy cache layout; returns None
+# if the file is missing or not a journal
+def recoverJournal(path):
+	replay = _replayJournal(path)
+	if replay is None:
+		return None
+	names, fields, records, intact = replay
+	return _toCacheBanks(names, fields)
+
+# returns (bank names, per bank {(field, channel): (value,
+# timestamp)}, valid record count, intact) where intact is
+# False if replay stopped short of the end of the file
+def _replayJournal(path):
+
+	try:
+		infile = open(path, "rb")
+	except OSError:
+		return None
+
+	with infile:
+		size = os.fstat(infile.fileno()).st_size
+		if size < JOURNAL_HEADER.size:
+			return None
+
+		with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+			magic, version, recordSize, namesLength = JOURNAL_HEADER.unpack_from(data, 0)
+			if (magic != JOURNAL_MAGIC) or (version != JOURNAL_VERSION) or (recordSize != JOURNAL_RECORD.size):
+				return None
+			offset = JOURNAL_HEADER.size + namesLength
+			try:
+				names = json.loads(data[JOURNAL_HEADER.size:offset].decode("utf-8"))
+			except ValueError:
+				return None
+			offset += -offset % JOURNAL_RECORD.size
+
+			# replay in order; later records supersede earlier
+			# ones for the same field
+			fields = [{} for name in names]
+			count = (size - offset) // JOURNAL_RECORD.size
+			records = 0
+			for i in range(count):
+				position = offset + (i * JOURNAL_RECORD.size)
+				bank, field, channel, check, value, timestamp = JOURNAL_RECORD.unpack_from(data, position)
+				if check != (zlib.crc32(data[position:position + 3] + b"\0" + data[position + 4:position + JOURNAL_RECORD.size]) & 0xff):
+					break
+				if bank >= len(names):
+					break
+				fields[bank][(field, channel)] = (value, timestamp)
+				records += 1
+
+	intact = (records == count) and (offset + (count * JOURNAL_RECORD.size) == size)
+	return names, fields, records, intact
+
+def _toCacheBanks(names, fields):
+
+	banks = {}
+	for name, records in zip(names, fields):
+		banks[name] = _toCache(records)
+
+	cache = banks.pop(None, {"inputs": [], "outputs": []})
+	cache["banks"] = banks
+	return cache
+
+def _toCache(records):
+
+	numInputs = 0
+	numOutputs = 0
+	for field, channel in records:
+		if field == FIELD_OUTPUT_STATE:
+			numOutputs = max(numOutputs, channel + 1)
+		else:
+			numInputs = max(numInputs, channel + 1)
+
+	cache = {}
+	cache["inputs"] = [{} for i in range(numInputs)]
+	cache["outputs"] = [{} for i in range(numOutputs)]
+	for (field, channel), (value, timestamp) in records.items():
+		if field == FIELD_OUTPUT_STATE:
+			cache["outputs"][channel]["state"] = value
+		elif field == FIELD_INPUT_STATE:
+			cache["inputs"][channel]["state"] = value
+			cache["inputs"][channel]["time_last_change"] = timestamp if timestamp > 0 else None
+		elif field == FIELD_INPUT_PULLUP:
+			cache["inputs"][channel]["pullup"] = value
+		elif field == FIELD_INPUT_COUNT:
+			cache["inputs"][channel]["count"] = int(timestamp)
+	return cache
+
+class distio_state_journal(distio_cache_writer):
+
+	# banks() returns a list of (bank name, distio_io_state)
+	# with the client's own bank (named None) first
+	def __init__(self, path, banks, intervalMs=500, stats=None, compactRecords=4096):
+
+		distio_cache_writer.__init__(self, path, self._changes, intervalMs, stats)
+		self.banks = banks
+		self.compactRecords = compactRecords
+
+		self.fd = None
+		self.records = 0
+		self.journaled = None
+		self.pending = None
+		self.recovered = None
+
+	def stop(self):
+		distio_cache_writer.stop(self)
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+
+	# replay the journal into the legacy cache layout (None if
+	# there is none) and remember whether resume() may append
+	# to it as it is
+	def recover(self):
+		replay = _replayJournal(self.path)
+		if replay is None:
+			return None
+		names, fields, records, intact = replay
+		self.recovered = (names, records, intact)
+		return _toCacheBanks(names, fields)
+
+	# start journaling from the current (restored) state;
+	# appends to the recovered journal if it was intact and
+	# names the same banks, otherwise compacts. Returns True
+	# if it compacted
+	def resume(self):
+		recovered = self.recovered
+		self.recovered = None
+		banks = self.banks()
+		if (recovered is None) or (not recovered[2]) or (recovered[0] != [name for name, state in banks]):
+			self.compact()
+			return True
+
+		with self.writeLock:
+			with self.condition:
+				self.dirty = False
+			self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+			self.records = recovered[1]
+			self.journaled = [self._capture(state) for name, state in banks]
+		return False
+
+	# replace the journal with a snapshot of the current state
+	def compact(self):
+		with self.writeLock:
+			with self.condition:
+				self.dirty = False
+			self._compact()
+
+	# records for every field changed since the last flush
+	def _changes(self):
+
+		if self.journaled is None:
+			return None
+
+		# the state is captured once per bank and the records
+		# built from the capture, so a change made meanwhile on
+		# the mainloop is picked up by the next flush
+		records = []
+		captures = []
+		now = time.time()
+		for index, (name, state) in enumerate(self.banks()):
+			capture = self._capture(state)
+			captures.append(capture)
+			outputs, inputs, pullups, times, counts = capture
+			previous = self.journaled[index]
+			self._diff(records, index, FIELD_OUTPUT_STATE, outputs ^ previous[0], outputs, now)
+			self._diff(records, index, FIELD_INPUT_PULLUP, pullups ^ previous[2], pullups, now)
+
+			# an input's change time moves with every edge
+			changed = inputs ^ previous[1]
+			for channel in range(len(times)):
+				if times[channel] != previous[3][channel]:
+					changed |= (1 << channel)
+			while changed:
+				bit = changed & -changed
+				changed ^= bit
+				channel = bit.bit_length() - 1
+				records.append(_packRecord(index, FIELD_INPUT_STATE, channel, (inputs >> channel) & 1, self._wallTime(times[channel])))
+
+			for channel in range(len(counts)):
+				if (counts[channel] is not None) and (counts[channel] != previous[4][channel]):
+					records.append(_packRecord(index, FIELD_INPUT_COUNT, channel, 0, float(counts[channel])))
+
+		# becomes the baseline once write() has the records
+		# on disk
+		self.pending = captures
+		return b"".join(records)
+
+	def _diff(self, records, index, field, changed, word, now):
+		while changed:
+			bit = changed & -changed
+			changed ^= bit
+			channel = bit.bit_length() - 1
+			records.append(_packRecord(index, field, channel, (word >> channel) & 1, now))
+
+	def _capture(self, state):
+		return (state.outputs.state, state.inputs.state, state.inputs.pullup,
+			[record.time_last_change for record in state.inputs.channels],
+			[record.count for record in state.inputs.channels])
+
+	# change times are monotonic in memory; 0 records none
+	def _wallTime(self, timestamp):
+		if timestamp is None:
+			return 0.0
+		return distio_clock.toWall(timestamp)
+
+	def write(self, data):
+
+		if (data is None) or (self.fd is None) or (self.records >= self.compactRecords):
+			self._compact()
+			return
+		if not data:
+			self.journaled = self.pending
+			return
+
+		try:
+			os.write(self.fd, data)
+			os.fsync(self.fd)
+		except OSError:
+			self.journaled = None
+			raise
+		self.journaled = self.pending
+		self.records += len(data) // JOURNAL_RECORD.size
+		if self.stats is not None:
+			self.stats.count("journal_records", len(data) // JOURNAL_RECORD.size)
+
+	def _compact(self):
+
+		banks = self.banks()
+		records = []
+		captures = []
+		now = time.time()
+		self.journaled = None
+		for index, (name, state) in enumerate(banks):
+			capture = self._capture(state)
+			outputs, inputs, pullups, times, counts = capture
+			for channel in range(state.outputs.count):
+				records.append(_packRecord(index, FIELD_OUTPUT_STATE, channel, (outputs >> channel) & 1, now))
+			for channel in range(state.inputs.count):
+				records.append(_packRecord(index, FIELD_INPUT_STATE, channel, (inputs >> channel) & 1, self._wallTime(times[channel])))
+				records.append(_packRecord(index, FIELD_INPUT_PULLUP, channel, (pullups >> channel) & 1, now))
+				if counts[channel] is not None:
+					records.append(_packRecord(index, FIELD_INPUT_COUNT, channel, 0, float(counts[channel])))
+			captures.append(capture)
+
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+		distio_cache_writer.write(self, _packHeader([name for name, state in banks]) + b"".join(records))
+		self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+		self.records = len(records)
+		self.journaled = captures
@@ -0,0 +1,79 @@
+# distio_limiter
+#
+# Per-channel input publish policy
+#
+# A token bucket bounds how often a channel may publish: up to
+# burst publishes back-to-back, refilled at one per minIntervalMs.
+# Transitions arriving with no token are suppressed and counted.
+# With coalesce enabled the client publishes the latest state and
+# the suppressed count once a token becomes available (trailing
+# edge), so the final state is never lost to rate limiting.
+#
+# Policies are configured with the "inputPublishPolicy" config
+# object; per-channel entries override the defaults:
+#
+# "inputPublishPolicy": {
+#     "minIntervalMs": 50, "burst": 4, "coalesce": true,
+#     "channels": {"3": {"minIntervalMs": 500}}
+# }
+#
+# A minIntervalMs of 0 (the default) disables limiting.
+#
+
+import threading
+
+class distio_publish_limiter():
+
+	__slots__ = ("intervalSecs", "burst", "coalesce", "tokens", "lastRefill",
+		"suppressed", "published", "trailingTimer", "lock")
+
+	def __init__(self, minIntervalMs=0, burst=1, coalesce=True):
+		self.intervalSecs = minIntervalMs / 1000.0
+		self.burst = max(1, int(burst))
+		self.coalesce = coalesce
+		self.tokens = float(self.burst)
+		self.lastRefill = None
+		self.suppressed = 0
+		self.published = None
+		self.trailingTimer = None
+		self.lock = threading.Lock()
+
+	@classmethod
+	def fromConfig(cls, params):
+		return cls(float(params.get("minIntervalMs", 0)), int(params.get("burst", 1)), bool(params.get("coalesce", True)))
+
+	def enabled(self):
+		return self.intervalSecs > 0
+
+	def _refill(self, now):
+		if self.lastRefill is not None:
+			self.tokens = min(float(self.burst), self.tokens + ((now - self.lastRefill) / self.intervalSecs))
+		self.lastRefill = now
+
+	# consume a token; returns False and counts the transition
+	# as suppressed if the channel is over budget
+	def allow(self, now):
+		if not self.enabled():
+			return True
+		with self.lock:
+			self._refill(now)
+			if self.tokens >= 1:
+				self.tokens -= 1
+				return True
+			self.suppressed += 1
+			return False
+
+	# seconds until the next token is available
+	def delay(self, now):
+		with self.lock:
+			self._refill(now)
+			if self.tokens >= 1:
+				return 0
+			return (1 - self.tokens) * self.intervalSecs
+
+	# return and reset the suppressed transition count
+	def takeSuppressed(self):
+		with self.lock:
+			suppressed = self.suppressed
+			self.suppressed = 0
+			return suppressed
@@ -0,0 +1,170 @@
+# distio_outbox
+#
+# Bounded outbound queue for IO publishes
+#
+# While connected, publishes go straight to paho. While the
+# broker is unreachable they are held here instead of piling up
+# in paho's unbounded queue:
+#
+#  - retained (state) topics collapse to their latest value, so
+#    an output toggled a thousand times offline replays once
+#  - other (transition event) messages are kept in order up to
+#    maxEvents; beyond that they are spilled to spoolFile (up to
+#    maxSpoolBytes) if one is configured, otherwise the oldest
+#    are dropped; once the spool is full too new events are
+#    dropped. Drops are counted
+#
+# On reconnect the queue is replayed from the mainloop at no
+# more than replayPerSec messages per second, current state
+# first and then events oldest first. Publishes made while a
+# replay is in progress queue behind it to keep event order.
+#
+# Configured with the "offlineQueue" config object:
+#
+# "offlineQueue": {
+#     "maxEvents": 1000, "replayPerSec": 500,
+#     "spoolFile": "/var/tmp/distio.spool", "maxSpoolBytes": 1048576
+# }
+#
+# The outbox belongs to the mainloop and is not locked: publish()
+# must only be called there, so bank commands arriving on paho's
+# network thread are handed over with callSoon before they
+# publish. Only setConnected() may be called from paho's thread.
+#
+
+import os
+import struct
+import collections
+
+SPOOL_RECORD = struct.Struct("<BHI")
+
+class distio_outbox():
+
+	def __init__(self, mqttc, scheduler, maxEvents=1000, replayPerSec=500,
+			spoolFile=None, maxSpoolBytes=1048576, stats=None):
+
+		self.mqttc = mqttc
+		self.scheduler = scheduler
+		self.maxEvents = max(1, int(maxEvents))
+		self.replayPerSec = max(1.0, float(replayPerSec))
+		self.spoolFile = spoolFile
+		self.maxSpoolBytes = maxSpoolBytes
+		self.stats = stats
+
+		self.connected = False
+		self.state = collections.OrderedDict()
+		self.events = collections.deque()
+		self.spoolBytes = 0
+		self.spoolOffset = 0
+		self.dropped = 0
+		self.replayTimer = None
+
+		# the spool only relieves memory for one outage
+		if self.spoolFile is not None:
+			try:
+				os.remove(self.spoolFile)
+			except OSError:
+				pass
+
+	@classmethod
+	def fromConfig(cls, mqttc, scheduler, params, stats=None):
+		return cls(mqttc, scheduler, int(params.get("maxEvents", 1000)), float(params.get("replayPerSec", 500)),
+			params.get("spoolFile"), int(params.get("maxSpoolBytes", 1048576)), stats)
+
+	def pending(self):
+		return bool(self.state or self.events or self.spoolBytes)
+
+	# mainloop only
+	def publish(self, topic, payload, qos=0, retain=False):
+
+		if self.connected and not self.pending():
+			self.mqttc.publish(topic, payload, qos, retain)
+			return
+
+		if retain:
+			self.state[topic] = (payload, qos)
+			self.state.move_to_end(topic)
+		elif self.spoolBytes or (len(self.events) >= self.maxEvents):
+			self._spool(topic, payload, qos)
+		else:
+			self.events.append((topic, payload, qos))
+
+	# paho network thread or mainloop
+	def setConnected(self, connected):
+		self.connected = connected
+		if connected:
+			self.scheduler.callSoon(self._startReplay)
+
+	def _spool(self, topic, payload, qos):
+
+		if self.spoolFile is not None:
+			data = payload.encode("utf-8") if isinstance(payload, str) else payload
+			encoded = topic.encode("utf-8")
+			record = SPOOL_RECORD.pack(qos, len(encoded), len(data)) + encoded + data
+			if self.spoolBytes + len(record) <= self.maxSpoolBytes:
+				with open(self.spoolFile, "ab") as outfile:
+					outfile.write(record)
+				self.spoolBytes += len(record)
+				return
+
+		# no room; without a spool the oldest event in memory
+		# makes way, with a full spool the new one is lost
+		if not self.spoolBytes:
+			self.events.popleft()
+			self.events.append((topic, payload, qos))
+		self.dropped += 1
+		if self.stats is not None:
+			self.stats.count("outbox_dropped")
+
+	def _startReplay(self):
+		if self.replayTimer is None and self.pending():
+			self.replayTimer = self.scheduler.callSoon(self._replay)
+
+	# send one batch, then rearm for the next
+	def _replay(self):
+
+		self.replayTimer = None
+		if not self.connected:
+			return
+
+		batchSecs = 0.05
+		budget = max(1, int(self.replayPerSec * batchSecs))
+		sent = 0
+		while sent < budget and self.state:
+			topic, (payload, qos) = self.state.popitem(last=False)
+			self.mqttc.publish(topic, payload, qos, True)
+			sent += 1
+		while sent < budget and self.events:
+			topic, payload, qos = self.events.popleft()
+			self.mqttc.publish(topic, payload, qos, False)
+			sent += 1
+		if sent < budget and self.spoolBytes:
+			sent += self._replaySpool(budget - sent)
+
+		if self.stats is not None and sent:
+			self.stats.count("outbox_replayed", sent)
+		if self.pending():
+			self.replayTimer = self.scheduler.callLater(batchSecs, self._replay)
+
+	def _replaySpool(self, budget):
+
+		sent = 0
+		with open(self.spoolFile, "rb") as infile:
+			infile.seek(self.spoolOffset)
+			while sent < budget and self.spoolOffset < self.spoolBytes:
+				qos, topicLength, payloadLength = SPOOL_RECORD.unpack(infile.read(SPOOL_RECORD.size))
+				topic = infile.read(topicLength).decode("utf-8")
+				payload = infile.read(payloadLength)
+				self.spoolOffset += SPOOL_RECORD.size + topicLength + payloadLength
+				self.mqttc.publish(topic, payload, qos, False)
+				sent += 1
+
+		# spool drained
+		if self.spoolOffset >= self.spoolBytes:
+			self.spoolBytes = 0
+			self.spoolOffset = 0
+			try:
+				os.remove(self.spoolFile)
+			except OSError:
+				pass
+		return sent
@@ -0,0 +1,96 @@
+# distio_poller
+#
+# Adaptive input polling for banks without interrupts
+#
+# Every poll is timed and its cost tracked as an exponentially
+# weighted moving average. The poll interval then adapts:
+#
+#  - after an input change it drops to minIntervalMs (the target
+#    poll rate) so a burst of activity is followed closely
+#  - once no change has been seen for idleAfterMs it grows by
+#    backoff per poll up to maxIntervalMs
+#  - with a cpuBudget (fraction of one core, eg. 0.05) it never
+#    falls below the interval at which the average poll cost
+#    would exceed that budget
+#
+# Configured with the "inputPolling" config object (client wide
+# or per bank):
+#
+# "inputPolling": {
+#     "minIntervalMs": 1, "maxIntervalMs": 10, "idleAfterMs": 1000,
+#     "backoff": 2.0, "cpuBudget": 0.05
+# }
+#
+# minIntervalMs defaults to inputPollIntervalMs; setting
+# maxIntervalMs equal to it gives the former fixed rate poll.
+#
+
+import distio_clock
+
+class distio_input_poller():
+
+	def __init__(self, scheduler, poll, minIntervalMs=1, maxIntervalMs=10, idleAfterMs=1000,
+			backoff=2.0, cpuBudget=0, alpha=0.1):
+
+		# poll() returns a bitmask of changed channels
+		self.scheduler = scheduler
+		self.poll = poll
+
+		self.minIntervalSecs = minIntervalMs / 1000.0
+		self.maxIntervalSecs = max(maxIntervalMs, minIntervalMs) / 1000.0
+		self.idleAfterSecs = idleAfterMs / 1000.0
+		self.backoff = max(1.0, backoff)
+		self.cpuBudget = cpuBudget
+		self.alpha = alpha
+
+		self.costMs = None
+		self.intervalSecs = self.minIntervalSecs
+		self.lastActivity = None
+		self.polls = 0
+		self.timer = None
+
+	@classmethod
+	def fromConfig(cls, scheduler, poll, params, intervalMs):
+		minIntervalMs = float(params.get("minIntervalMs", intervalMs))
+		return cls(scheduler, poll, minIntervalMs,
+			float(params.get("maxIntervalMs", max(10.0, minIntervalMs))),
+			float(params.get("idleAfterMs", 1000)),
+			float(params.get("backoff", 2.0)),
+			float(params.get("cpuBudget", 0)),
+			float(params.get("alpha", 0.1)))
+
+	def start(self):
+		if self.timer is None:
+			self.timer = self.scheduler.callLater(self.intervalSecs, self._poll)
+
+	def stop(self):
+		if self.timer is not None:
+			self.scheduler.cancel(self.timer)
+			self.timer = None
+
+	def _poll(self):
+
+		timeStart = distio_clock.now()
+		changed = self.poll()
+		now = distio_clock.now()
+
+		cost = (now - timeStart) * 1000
+		if self.costMs is None:
+			self.costMs = cost
+		else:
+			self.costMs += self.alpha * (cost - self.costMs)
+		self.polls += 1
+
+		if changed:
+			self.lastActivity = now
+			self.intervalSecs = self.minIntervalSecs
+		elif (self.lastActivity is None) or (now - self.lastActivity >= self.idleAfterSecs):
+			self.intervalSecs = min(self.maxIntervalSecs, self.intervalSecs * self.backoff)
+
+		interval = self.intervalSecs
+		if self.cpuBudget > 0:
+			interval = max(interval, (self.costMs / 1000.0) / self.cpuBudget)
+
+		# stop() may have been called by the poll itself
+		if self.timer is not None:
+			self.timer = self.scheduler.callLater(interval, self._poll)
@@ -8,7 +8,7 @@
 #       a value of 0 indicates indefinite (may need to change)
 #
 
-import time
+import distio_clock
 
 class distio_pulse():
 
@@ -52,13 +52,55 @@ class distio_pulse():
 		
 		return False
 		
+	# timers are monotonic seconds (distio_clock)
 	def startTimer(self):
-		self.timer = time.time()
+		self.timer = distio_clock.now()
+
+	# restart the timer from the transition deadline rather
+	# than from now, so patterns do not drift with scheduling
+	# latency and channels started together stay in lockstep.
+	# Restart from now if we have fallen a full period behind
+	def advanceTimer(self, period):
+		now = distio_clock.now()
+		deadline = self.timer + (period / 1000.0)
+		if (now - deadline) * 1000 > period:
+			deadline = now
+		self.timer = deadline
 		
 	def checkTimer(self):
-		elapsedTime = (time.time() - self.timer) * 1000;
+		elapsedTime = (distio_clock.now() - self.timer) * 1000;
 		return elapsedTime
 
+	# monotonic time (seconds) of the next transition
+	# or None if the pulse program is not running
+	def nextDeadline(self):
+
+		if not (self.configured and self.running):
+			return None
+
+		if self.state == 0:
+			period = self.on_time
+		elif self.state == 1:
+			period = self.off_time
+		else:
+			period = self.time_between_sets
+
+		return self.timer + (period / 1000.0)
+
+	# running program and its progress for state queries, or
+	# None if the output is not pulsing
+	def status(self):
+
+		if not (self.configured and self.running):
+			return None
+
+		status = {}
+		status["args"] = [self.on_time, self.off_time, self.num_reps, self.time_between_sets, self.num_sets]
+		status["phase"] = self.state
+		status["rep"] = self.currentRep
+		status["set"] = self.currentSet
+		return status
+
 	# advance time, process state
 	def process(self):
 
@@ -70,7 +112,7 @@ class distio_pulse():
 			
 			# Waiting in a pulse
 			if self.state == 0:
-				if self.checkTimer() > self.on_time:
+				if self.checkTimer() >= self.on_time:
 					self.outputRequest = 0
 					
 					# if an off time has not been declared, we
@@ -79,24 +121,24 @@ class distio_pulse():
 						self.running = False
 					else:
 						self.state = 1
-						self.startTimer()
+						self.advanceTimer(self.on_time)
 					
 			# Waiting after a pulse
 			elif self.state == 1:
 				
-				if self.checkTimer() > self.off_time:
+				if self.checkTimer() >= self.off_time:
 					
 					# number of reps not specified but off time
 					# was thus, we are looping indefinitely
 					if (self.num_reps <= 0):
-						self.startTimer()
+						self.advanceTimer(self.off_time)
 						self.state = 0
 						self.outputRequest = 1
 					# we are tracking number of reps
 					elif (self.num_reps > 0):
 						if self.currentRep < self.num_reps:
 							# go into another rep
-							self.startTimer()
+							self.advanceTimer(self.off_time)
 							self.currentRep = self.currentRep + 1
 							self.state = 0
 							self.outputRequest = 1
@@ -106,14 +148,14 @@ class distio_pulse():
 							if self.time_between_sets >= 0:
 								# waiting between reps
 								self.state = 2
-								self.startTimer()
+								self.advanceTimer(self.off_time)
 							else:
 								# concluded our reps
 								self.running = False
 
 			# Waiting in between sets
 			elif self.state == 2:
-				if self.checkTimer() > self.time_between_sets:
+				if self.checkTimer() >= self.time_between_sets:
 					
 					# have we completed our sets?
 					if (self.currentSet < self.num_sets) or (self.num_sets <= 0):
@@ -122,7 +164,7 @@ class distio_pulse():
 						self.currentSet = self.currentSet + 1
 						self.state = 0
 						self.outputRequest = 1
-						self.startTimer()
+						self.advanceTimer(self.time_between_sets)
 					else:
 						# we are done
 						self.running = False
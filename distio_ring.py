@@ -0,0 +1,75 @@
+# distio_ring
+#
+# Bounded input event ring between hardware listeners and the
+# mainloop
+#
+# The interrupt path records only (channel, level, timestamp)
+# into preallocated arrays and advances the head index; no
+# objects are allocated and no locks are taken. The mainloop
+# drains events in batches to build and publish them.
+#
+# One producer thread and one consumer (the mainloop) per ring.
+# head is only written by the producer and tail only by the
+# consumer; a slot is written before head is advanced past it,
+# and under the GIL each index store is atomic, so neither side
+# ever sees a partially written record.
+#
+# When the ring is full new events are dropped and counted in
+# overflows; the consumer resynchronizes from the hardware so
+# the published state still converges.
+#
+
+from array import array
+
+class distio_event_ring():
+
+	def __init__(self, capacity=1024):
+
+		# round up to a power of two so indexes wrap with a mask
+		size = 1
+		while size < capacity:
+			size <<= 1
+		self.capacity = size
+		self.mask = size - 1
+
+		self.channels = array("i", [0]) * size
+		self.levels = array("b", [0]) * size
+		self.timestamps = array("d", [0.0]) * size
+
+		self.head = 0
+		self.tail = 0
+		self.overflows = 0
+		self.highWater = 0
+
+	def __len__(self):
+		return self.head - self.tail
+
+	# producer; returns False if the event was dropped
+	def push(self, channel, level, timestamp):
+		head = self.head
+		if head - self.tail >= self.capacity:
+			self.overflows += 1
+			return False
+		slot = head & self.mask
+		self.channels[slot] = channel
+		self.levels[slot] = level
+		self.timestamps[slot] = timestamp
+		self.head = head + 1
+		return True
+
+	# consumer; calls handler(channel, level, timestamp) for up
+	# to limit queued events in order and returns the count
+	def drain(self, handler, limit=None):
+		tail = self.tail
+		head = self.head
+		if head - tail > self.highWater:
+			self.highWater = head - tail
+		if (limit is not None) and (head - tail > limit):
+			head = tail + limit
+		count = head - tail
+		while tail != head:
+			slot = tail & self.mask
+			handler(self.channels[slot], self.levels[slot], self.timestamps[slot])
+			tail += 1
+			self.tail = tail
+		return count
@@ -0,0 +1,63 @@
+# distio_router
+#
+# Inbound MQTT command routing table
+#
+# Command topics have the fixed shape
+#
+# io/{client-name}/{io-class}/{channel}/set/{parameter}
+# io/{client-name}/{bank}/{io-class}/{channel}/set/{parameter}
+#
+# (the second form addressing a named IO bank) so rather than
+# running a regular expression per message the topic is split
+# once and the handler is found with a single dictionary lookup
+# keyed on (bank, io-class, parameter). The table is built once
+# when the client connects; adding a verb is a matter of
+# registering another handler.
+#
+# Handlers are called as handler(channel, payload, topic) with
+# channel as the (unvalidated) string from the topic.
+#
+
+class distio_router():
+
+	def __init__(self, prefix):
+
+		# "io/{client-name}/"
+		self.prefix = prefix.rstrip("/") + "/"
+		self.routes = {}
+
+	# bank is None for channels of the client's own bank
+	def add(self, ioClass, parameter, handler, bank=None):
+		self.routes[(bank, ioClass, parameter.lower())] = handler
+
+	# returns (handler, channel) or (None, None) if the topic
+	# is not a recognized command
+	def match(self, topic):
+
+		if not topic.startswith(self.prefix):
+			return None, None
+
+		# [{bank}/]{io-class}/{channel}/set/{parameter}
+		parts = topic[len(self.prefix):].split("/")
+		if len(parts) == 4:
+			bank = None
+		elif len(parts) == 5:
+			bank = parts.pop(0)
+		else:
+			return None, None
+		if parts[2] != "set":
+			return None, None
+
+		handler = self.routes.get((bank, parts[0], parts[3].lower()))
+		if handler is None:
+			return None, None
+		return handler, parts[1]
+
+	# route and execute; returns True if the topic was not
+	# handled so the caller may report it
+	def dispatch(self, topic, payload):
+		handler, channel = self.match(topic)
+		if handler is None:
+			return True
+		handler(channel, payload, topic)
+		return False
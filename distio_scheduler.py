@@ -0,0 +1,183 @@
+# distio_scheduler
+#
+# Deadline scheduler driving the distio_client mainloop
+#
+# Timers are kept in a heap ordered by deadline (monotonic
+# seconds). The mainloop sleeps on a condition until the
+# earliest deadline is due or another thread schedules new
+# work, so an idle client blocks fully instead of spinning.
+#
+# With a tick configured, timer deadlines are rounded up to the
+# next tick boundary so that timers due within the same tick
+# fire together (never early). Tick handlers run once after each
+# batch of timers, letting callers collect work during the tick
+# and commit it in one go (eg. one output bank write).
+#
+# Callbacks always execute on the thread which called run().
+# MQTT callbacks (paho thread) and hardware listeners hand
+# work to the mainloop with callSoon() rather than touching
+# shared state directly.
+#
+# A callback which raises does not end the mainloop: the
+# exception is handed to onError(callback, exception) (the
+# client logs it) and the remaining timers still run; a
+# periodic timer stays scheduled.
+#
+
+import heapq
+import math
+import threading
+import time
+import traceback
+
+# run a timer or tick callback for scheduler; an exception
+# is reported through scheduler.onError instead of unwinding
+# the mainloop
+def callbackSafe(scheduler, callback, args):
+	try:
+		callback(*args)
+	except Exception as e:
+		if scheduler.onError is None:
+			traceback.print_exc()
+		else:
+			scheduler.onError(callback, e)
+
+class distio_timer():
+
+	__slots__ = ("deadline", "interval", "callback", "args", "cancelled", "handle")
+
+	def __init__(self, deadline, interval, callback, args):
+		self.deadline = deadline
+		self.interval = interval
+		self.callback = callback
+		self.args = args
+		self.cancelled = False
+		self.handle = None
+
+class distio_scheduler():
+
+	def __init__(self, tickSecs=0):
+
+		self.tickSecs = tickSecs
+		self.tickHandlers = []
+
+		# heap of (deadline, sequence, timer); sequence keeps
+		# ordering stable for timers sharing a deadline
+		self.timers = []
+		self.sequence = 0
+		self.condition = threading.Condition()
+		self.running = False
+		self.onError = None
+
+		# the constructing thread owns the state until run()
+		# hands it to the mainloop thread; hardware listeners
+		# started in between still go through the event ring
+		self.threadId = threading.get_ident()
+
+	def now(self):
+		return time.monotonic()
+
+	def callAt(self, deadline, callback, *args):
+		return self._schedule(self._align(deadline), 0, callback, args)
+
+	def callLater(self, delaySecs, callback, *args):
+		return self._schedule(self._align(self.now() + delaySecs), 0, callback, args)
+
+	# run on the mainloop as soon as possible; not tick aligned
+	def callSoon(self, callback, *args):
+		return self._schedule(self.now(), 0, callback, args)
+
+	# periodic timer; the next deadline is advanced from the
+	# previous deadline, not from when the callback ran, so
+	# the period does not drift
+	def callEvery(self, intervalSecs, callback, *args):
+		return self._schedule(self._align(self.now() + intervalSecs), intervalSecs, callback, args)
+
+	# callback() runs after every batch of due timers
+	def addTickHandler(self, callback):
+		self.tickHandlers.append(callback)
+
+	# round a deadline up to the next tick boundary
+	def _align(self, deadline):
+		if self.tickSecs <= 0:
+			return deadline
+		return math.ceil(deadline / self.tickSecs) * self.tickSecs
+
+	# cancelled timers are discarded lazily once they reach
+	# the top of the heap
+	def cancel(self, timer):
+		timer.cancelled = True
+
+	def _schedule(self, deadline, interval, callback, args):
+		timer = distio_timer(deadline, interval, callback, args)
+		with self.condition:
+			self._push(timer)
+			# wake the mainloop only if it is now sleeping
+			# past the earliest deadline
+			if self.timers[0][2] is timer:
+				self.condition.notify()
+		return timer
+
+	def _push(self, timer):
+		self.sequence += 1
+		heapq.heappush(self.timers, (timer.deadline, self.sequence, timer))
+
+	# wait for the next deadline (or timeout seconds) and
+	# execute every timer which has come due
+	def runOnce(self, timeout=None):
+
+		due = []
+		with self.condition:
+
+			while self.timers and self.timers[0][2].cancelled:
+				heapq.heappop(self.timers)
+
+			delay = timeout
+			if self.timers:
+				delay = self.timers[0][0] - self.now()
+				if (timeout is not None) and (delay > timeout):
+					delay = timeout
+
+			# block fully when nothing is pending
+			if (delay is None) or (delay > 0):
+				self.condition.wait(delay)
+
+			now = self.now()
+			while self.timers and (self.timers[0][0] <= now):
+				timer = heapq.heappop(self.timers)[2]
+				if not timer.cancelled:
+					due.append(timer)
+
+		for timer in due:
+			if timer.cancelled:
+				continue
+			callbackSafe(self, timer.callback, timer.args)
+			if timer.interval and not timer.cancelled:
+				timer.deadline += timer.interval
+				# skip missed periods rather than bursting
+				if timer.deadline <= now:
+					timer.deadline = self._align(now + timer.interval)
+				with self.condition:
+					self._push(timer)
+
+		if due:
+			for handler in self.tickHandlers:
+				callbackSafe(self, handler, ())
+
+		return len(due)
+
+	# True on the thread running the mainloop, or on the
+	# constructing thread before the mainloop has started
+	def onMainloop(self):
+		return self.threadId == threading.get_ident()
+
+	def run(self):
+		self.threadId = threading.get_ident()
+		self.running = True
+		while self.running:
+			self.runOnce()
+
+	def stop(self):
+		with self.condition:
+			self.running = False
+			self.condition.notify()
@@ -0,0 +1,292 @@
+# distio_segment
+#
+# Shared memory IO state segment for same-host readers
+#
+# The client mirrors the state of every bank into a fixed layout
+# file, normally on tmpfs (/dev/shm), which local processes map
+# with mmap and read directly; no broker round trip and no copy
+# through a socket. All values are little endian:
+#
+#   header (48 bytes)
+#     "DIOS", version (u16), banks (u16), segment size (u32),
+#     writer pid (u32), sequence (u64), updated (f64, epoch
+#     seconds), mailbox offset (u32), mailbox slots (u32)
+#   bank table, one 32 byte entry per bank
+#     name (24 bytes utf-8, null padded; empty for the client's
+#     own bank), inputs (u8), outputs (u8), data offset (u32)
+#   bank data
+#     outputs, inputs, pullups (u64 bitmasks, bit n is channel n)
+#     then per input: time_last_change (f64, epoch seconds, 0 if
+#     none) and count (i64, -1 if not a counter input)
+#
+# Updates are published with a seqlock: the writer makes the
+# sequence odd, writes the changed banks and makes it even again.
+# A reader takes the sequence, decodes straight from the mapping
+# and retries if the sequence was odd or has moved since; the
+# sequence doubles as a generation counter for cheap change
+# polling. Only the mainloop writes the segment.
+#
+# The optional mailbox lets one local process write output
+# commands: a ring of fixed slots with a head (u64, written by
+# the producer) and a tail (u64, written by the client) ahead of
+# the slots. A slot is
+#
+#   bank (u8), op (u8), channel (u8), pad, pad (u32),
+#   mask (u64), value (u64), pulse arguments (24 bytes ascii)
+#
+# and is written before head is advanced past it. The client
+# drains the mailbox every pollMs. There must be only one
+# producer per segment.
+#
+# Configured with the "stateSegment" config object:
+#
+# "stateSegment": {
+#     "file": "/dev/shm/distio-{client-name}",
+#     "mailboxSlots": 16, "mailboxPollMs": 20
+# }
+#
+# A new segment replaces the file atomically on startup, so a
+# reader holding an older mapping should reopen when stale()
+# reports the file was replaced.
+#
+
+import os
+import mmap
+import struct
+import time
+
+import distio_clock
+
+SEGMENT_MAGIC = b"DIOS"
+SEGMENT_VERSION = 1
+
+SEGMENT_HEADER = struct.Struct("<4sHHIIQdII")
+SEGMENT_HEADER_SIZE = 48
+SEGMENT_SEQUENCE = struct.Struct("<Q")
+SEGMENT_SEQUENCE_OFFSET = 16
+SEGMENT_BANK = struct.Struct("<24sBB2xI")
+SEGMENT_WORDS = struct.Struct("<QQQ")
+SEGMENT_CHANNEL = struct.Struct("<dq")
+
+MAILBOX_INDEX = struct.Struct("<QQ")
+MAILBOX_SLOT = struct.Struct("<BBBxIQQ24s")
+
+MAILBOX_OUTPUT_STATE = 1
+MAILBOX_OUTPUT_BANK = 2
+MAILBOX_OUTPUT_PULSE = 3
+
+MAX_CHANNELS = 64
+
+# layout shared by the writer and readers; banks is a list of
+# (name, inputs, outputs) and returns the data offset of each
+# bank, the mailbox offset and the segment size
+def _layout(banks, mailboxSlots):
+	offset = SEGMENT_HEADER_SIZE + (SEGMENT_BANK.size * len(banks))
+	offsets = []
+	for name, numInputs, numOutputs in banks:
+		offsets.append(offset)
+		offset += SEGMENT_WORDS.size + (SEGMENT_CHANNEL.size * numInputs)
+	mailboxOffset = offset
+	if mailboxSlots:
+		offset += MAILBOX_INDEX.size + (MAILBOX_SLOT.size * mailboxSlots)
+	return offsets, mailboxOffset, offset
+
+class distio_state_segment():
+
+	# banks() returns a list of (bank name, distio_io_state)
+	# with the client's own bank (named None) first
+	def __init__(self, path, banks, mailboxSlots=0):
+
+		self.path = path
+		self.banks = banks
+		self.mailboxSlots = max(0, int(mailboxSlots))
+
+		layout = []
+		for name, state in banks():
+			if (state.inputs.count > MAX_CHANNELS) or (state.outputs.count > MAX_CHANNELS):
+				raise ValueError("bank {0} has more than {1} channels".format(name, MAX_CHANNELS))
+			layout.append((name or "", state.inputs.count, state.outputs.count))
+		self.offsets, self.mailboxOffset, self.size = _layout(layout, self.mailboxSlots)
+
+		self.sequence = 0
+		self.mirrored = [None] * len(layout)
+		self.mailboxTail = 0
+
+		# build the file aside and rename it into place so a
+		# reader never maps a partly initialized segment
+		tempPath = "{0}.tmp".format(path)
+		fd = os.open(tempPath, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+		try:
+			os.ftruncate(fd, self.size)
+			self.data = mmap.mmap(fd, self.size)
+		finally:
+			os.close(fd)
+		SEGMENT_HEADER.pack_into(self.data, 0, SEGMENT_MAGIC, SEGMENT_VERSION, len(layout), self.size,
+			os.getpid(), 0, time.time(), self.mailboxOffset, self.mailboxSlots)
+		for index, (name, numInputs, numOutputs) in enumerate(layout):
+			SEGMENT_BANK.pack_into(self.data, SEGMENT_HEADER_SIZE + (index * SEGMENT_BANK.size),
+				name.encode("utf-8"), numInputs, numOutputs, self.offsets[index])
+		self.sync()
+		os.rename(tempPath, path)
+
+	def close(self):
+		if self.data is not None:
+			self.data.close()
+			self.data = None
+
+	# mainloop; mirror banks which changed since the last sync
+	def sync(self):
+
+		changed = []
+		for index, (name, state) in enumerate(self.banks()):
+			capture = (state.outputs.state, state.inputs.state, state.inputs.pullup,
+				[(record.time_last_change, record.count) for record in state.inputs.channels])
+			if capture != self.mirrored[index]:
+				changed.append((index, capture))
+		if not changed:
+			return False
+
+		data = self.data
+		self.sequence += 1
+		SEGMENT_SEQUENCE.pack_into(data, SEGMENT_SEQUENCE_OFFSET, self.sequence)
+		for index, capture in changed:
+			outputs, inputs, pullups, channels = capture
+			offset = self.offsets[index]
+			SEGMENT_WORDS.pack_into(data, offset, outputs, inputs, pullups)
+			offset += SEGMENT_WORDS.size
+			for timestamp, count in channels:
+				SEGMENT_CHANNEL.pack_into(data, offset,
+					0.0 if timestamp is None else distio_clock.toWall(timestamp),
+					-1 if count is None else count)
+				offset += SEGMENT_CHANNEL.size
+			self.mirrored[index] = capture
+		struct.pack_into("<d", data, SEGMENT_SEQUENCE_OFFSET + 8, time.time())
+		self.sequence += 1
+		SEGMENT_SEQUENCE.pack_into(data, SEGMENT_SEQUENCE_OFFSET, self.sequence)
+		return True
+
+	# mainloop; calls handler(bank index, op, channel, mask,
+	# value, arguments) for every queued command. head comes
+	# from another process, so at most one ring of slots is
+	# drained; a head beyond that (or behind the tail) was not
+	# written by a well behaved producer, and the mailbox is
+	# resynchronized to it without replaying anything and
+	# onOverrun(head, tail) is called
+	def drainMailbox(self, handler, onOverrun=None):
+
+		if not self.mailboxSlots:
+			return 0
+		head, tail = MAILBOX_INDEX.unpack_from(self.data, self.mailboxOffset)
+		if (head < self.mailboxTail) or (head - self.mailboxTail > self.mailboxSlots):
+			if onOverrun is not None:
+				onOverrun(head, self.mailboxTail)
+			self.mailboxTail = head
+			struct.pack_into("<Q", self.data, self.mailboxOffset + 8, self.mailboxTail)
+			return 0
+
+		slots = self.mailboxOffset + MAILBOX_INDEX.size
+		end = min(head, self.mailboxTail + self.mailboxSlots)
+		count = 0
+		while self.mailboxTail < end:
+			slot = slots + ((self.mailboxTail % self.mailboxSlots) * MAILBOX_SLOT.size)
+			bank, op, channel, pad, mask, value, arguments = MAILBOX_SLOT.unpack_from(self.data, slot)
+			handler(bank, op, channel, mask, value, arguments.rstrip(b"\0").decode("ascii", "replace"))
+			self.mailboxTail += 1
+			count += 1
+		if count:
+			struct.pack_into("<Q", self.data, self.mailboxOffset + 8, self.mailboxTail)
+		return count
+
+# same-host reader; maps the segment read only, or read/write
+# when it is used to queue mailbox commands
+class distio_state_reader():
+
+	def __init__(self, path, commands=False):
+
+		self.path = path
+		with open(path, "r+b" if commands else "rb") as infile:
+			self.inode = os.fstat(infile.fileno()).st_ino
+			self.data = mmap.mmap(infile.fileno(), 0, access=(mmap.ACCESS_WRITE if commands else mmap.ACCESS_READ))
+
+		magic, version, numBanks, size, self.pid, sequence, updated, self.mailboxOffset, self.mailboxSlots = \
+			SEGMENT_HEADER.unpack_from(self.data, 0)
+		if (magic != SEGMENT_MAGIC) or (version != SEGMENT_VERSION):
+			self.data.close()
+			raise ValueError("{0} is not a distio state segment".format(path))
+
+		# bank name (None for the client's own bank) -> (index, inputs,
+		# outputs, data offset)
+		self.banks = {}
+		for index in range(numBanks):
+			name, numInputs, numOutputs, offset = SEGMENT_BANK.unpack_from(self.data, SEGMENT_HEADER_SIZE + (index * SEGMENT_BANK.size))
+			name = name.rstrip(b"\0").decode("utf-8") or None
+			self.banks[name] = (index, numInputs, numOutputs, offset)
+
+	def close(self):
+		self.data.close()
+
+	# True if the client has since replaced the segment
+	def stale(self):
+		try:
+			return os.stat(self.path).st_ino != self.inode
+		except OSError:
+			return True
+
+	# even while stable; changes on every update
+	def generation(self):
+		return SEGMENT_SEQUENCE.unpack_from(self.data, SEGMENT_SEQUENCE_OFFSET)[0]
+
+	# consistent snapshot of every bank:
+	# {bank name: {"outputs": word, "inputs": word, "pullups": word,
+	#  "time_last_change": [...], "count": [...]}, "updated": epoch}
+	def read(self):
+		data = self.data
+		while True:
+			sequence = SEGMENT_SEQUENCE.unpack_from(data, SEGMENT_SEQUENCE_OFFSET)[0]
+			if sequence & 1:
+				time.sleep(0)
+				continue
+
+			snapshot = {}
+			for name, (index, numInputs, numOutputs, offset) in self.banks.items():
+				outputs, inputs, pullups = SEGMENT_WORDS.unpack_from(data, offset)
+				offset += SEGMENT_WORDS.size
+				channels = [SEGMENT_CHANNEL.unpack_from(data, offset + (i * SEGMENT_CHANNEL.size)) for i in range(numInputs)]
+				snapshot[name] = {
+					"outputs": outputs,
+					"inputs": inputs,
+					"pullups": pullups,
+					"time_last_change": [timestamp or None for timestamp, count in channels],
+					"count": [None if count < 0 else count for timestamp, count in channels],
+				}
+			snapshot["updated"] = struct.unpack_from("<d", data, SEGMENT_SEQUENCE_OFFSET + 8)[0]
+
+			if SEGMENT_SEQUENCE.unpack_from(data, SEGMENT_SEQUENCE_OFFSET)[0] == sequence:
+				return snapshot
+
+	#
+	# Mailbox; each returns True if the command was not queued
+	#
+
+	def setOutput(self, channel, value, bank=None):
+		return self._queue(bank, MAILBOX_OUTPUT_STATE, channel, 0, int(value), b"")
+
+	def setOutputs(self, mask, word, bank=None):
+		return self._queue(bank, MAILBOX_OUTPUT_BANK, 0, mask, word, b"")
+
+	# arguments as for the pulse command, eg. "100,100,5"
+	def pulse(self, channel, arguments, bank=None):
+		return self._queue(bank, MAILBOX_OUTPUT_PULSE, channel, 0, 0, str(arguments).encode("ascii"))
+
+	def _queue(self, bank, op, channel, mask, value, arguments):
+
+		if (not self.mailboxSlots) or (bank not in self.banks) or (len(arguments) > 24):
+			return True
+		head, tail = MAILBOX_INDEX.unpack_from(self.data, self.mailboxOffset)
+		if head - tail >= self.mailboxSlots:
+			return True
+
+		slot = self.mailboxOffset + MAILBOX_INDEX.size + ((head % self.mailboxSlots) * MAILBOX_SLOT.size)
+		MAILBOX_SLOT.pack_into(self.data, slot, self.banks[bank][0], op, channel, 0, mask, value, arguments)
+		struct.pack_into("<Q", self.data, self.mailboxOffset, head + 1)
+		return False
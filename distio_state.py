@@ -0,0 +1,117 @@
+# distio_state
+#
+# Compact IO state model
+#
+# Each bank of channels keeps its states and pullups packed
+# into integer bitmasks (bit n is channel n), so a whole bank
+# is compared against a fresh hardware read with a single XOR.
+# Per-channel data which does not pack into a bit (timestamps,
+# edge counts) lives in a slotted record per channel.
+#
+# The state serializes to and from the original cache layout:
+#
+# {"inputs": [{"state": 0, "pullup": 1, "time_last_change": null}, ...],
+#  "outputs": [{"state": 0}, ...]}
+#
+# time_last_change is monotonic in memory and epoch seconds in
+# the cache.
+#
+
+import distio_clock
+
+class distio_channel():
+
+	__slots__ = ("time_last_change", "count")
+
+	def __init__(self):
+		self.time_last_change = None
+		self.count = None
+
+class distio_bank_state():
+
+	__slots__ = ("count", "mask", "state", "pullup", "channels")
+
+	def __init__(self, count, pullup=0):
+		self.count = count
+		self.mask = (1 << count) - 1
+		self.state = 0
+		self.pullup = self.mask if pullup else 0
+		self.channels = [distio_channel() for i in range(count)]
+
+	def __len__(self):
+		return self.count
+
+	def get(self, channel):
+		return (self.state >> channel) & 1
+
+	def set(self, channel, value):
+		if value:
+			self.state |= (1 << channel)
+		else:
+			self.state &= ~(1 << channel)
+
+	def getPullup(self, channel):
+		return (self.pullup >> channel) & 1
+
+	def setPullup(self, channel, value):
+		if value:
+			self.pullup |= (1 << channel)
+		else:
+			self.pullup &= ~(1 << channel)
+
+	# bitmask of channels which differ from the supplied word
+	def changed(self, word):
+		return (word ^ self.state) & self.mask
+
+class distio_io_state():
+
+	def __init__(self, numInputs, numOutputs):
+
+		# default to false input state until checked later on
+		# default to internal pullups enabled for all inputs
+		# otherwise, unknowing users will be surprised with noise
+		self.inputs = distio_bank_state(numInputs, pullup=1)
+		self.outputs = distio_bank_state(numOutputs)
+
+	def toCache(self):
+		cache = {}
+		cache["inputs"] = []
+		for i in range(self.inputs.count):
+			cache["inputs"].append({
+				"state": self.inputs.get(i),
+				"pullup": self.inputs.getPullup(i),
+				"time_last_change": self._toWall(self.inputs.channels[i].time_last_change),
+			})
+			# counter inputs only (see distio_counter)
+			if self.inputs.channels[i].count is not None:
+				cache["inputs"][i]["count"] = self.inputs.channels[i].count
+		cache["outputs"] = []
+		for i in range(self.outputs.count):
+			cache["outputs"].append({"state": self.outputs.get(i)})
+		return cache
+
+	def _toWall(self, timestamp):
+		if timestamp is None:
+			return None
+		return distio_clock.toWall(timestamp)
+
+	# load from the cache layout; channels missing from the
+	# cache keep their defaults and extra channels are ignored
+	def fromCache(self, cache):
+		inputs = cache.get("inputs", [])
+		for i in range(min(len(inputs), self.inputs.count)):
+			if "state" in inputs[i]:
+				self.inputs.set(i, int(inputs[i]["state"]))
+			if "pullup" in inputs[i]:
+				self.inputs.setPullup(i, int(inputs[i]["pullup"]))
+			timestamp = inputs[i].get("time_last_change")
+			if timestamp is not None:
+				timestamp = distio_clock.fromWall(timestamp)
+			self.inputs.channels[i].time_last_change = timestamp
+			if inputs[i].get("count") is not None:
+				self.inputs.channels[i].count = int(inputs[i]["count"])
+
+		outputs = cache.get("outputs", [])
+		for i in range(min(len(outputs), self.outputs.count)):
+			if "state" in outputs[i]:
+				self.outputs.set(i, int(outputs[i]["state"]))
@@ -0,0 +1,116 @@
+# distio_stats
+#
+# Low overhead hot-path instrumentation
+#
+# Latencies are recorded into fixed-bucket histograms (a bisect
+# and two additions per sample, no allocation) and events into
+# plain counters. snapshot() returns counts, rates and
+# percentile estimates for the interval since the previous
+# snapshot and starts a new interval.
+#
+# Samples may be recorded from any thread; a sample racing a
+# snapshot may land in either interval, which is acceptable for
+# monitoring and keeps locks off the hot path.
+#
+
+from bisect import bisect_left
+import time
+
+# upper bucket bounds in milliseconds; the final bucket is
+# unbounded
+LATENCY_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+class distio_histogram():
+
+	__slots__ = ("bounds", "counts", "count", "total", "maximum")
+
+	def __init__(self, bounds=LATENCY_BUCKETS_MS):
+		self.bounds = bounds
+		self.reset()
+
+	def reset(self):
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.maximum = 0.0
+
+	def record(self, value):
+		self.counts[bisect_left(self.bounds, value)] += 1
+		self.count += 1
+		self.total += value
+		if value > self.maximum:
+			self.maximum = value
+
+	# upper bound of the bucket holding the q quantile; the
+	# observed maximum stands in for the unbounded bucket
+	def percentile(self, q):
+		if not self.count:
+			return None
+		target = q * self.count
+		cumulative = 0
+		for i in range(len(self.counts)):
+			cumulative += self.counts[i]
+			if cumulative >= target:
+				if i < len(self.bounds):
+					return min(self.bounds[i], self.maximum)
+				return self.maximum
+		return self.maximum
+
+	def snapshot(self):
+		snapshot = {}
+		snapshot["count"] = self.count
+		if self.count:
+			snapshot["mean"] = round(self.total / self.count, 3)
+			snapshot["max"] = round(self.maximum, 3)
+			snapshot["p50"] = round(self.percentile(0.50), 3)
+			snapshot["p99"] = round(self.percentile(0.99), 3)
+		snapshot["buckets"] = self.counts
+		return snapshot
+
+class distio_stats():
+
+	def __init__(self):
+		self.histograms = {}
+		self.counters = {}
+		self.intervalStart = time.monotonic()
+
+	def histogram(self, name):
+		if name not in self.histograms:
+			self.histograms[name] = distio_histogram()
+		return self.histograms[name]
+
+	def record(self, name, valueMs):
+		self.histogram(name).record(valueMs)
+
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def snapshot(self, reset=True):
+
+		now = time.monotonic()
+		elapsed = max(now - self.intervalStart, 1e-9)
+
+		snapshot = {}
+		snapshot["time"] = time.time()
+		snapshot["interval"] = round(elapsed, 3)
+		snapshot["bucket_bounds_ms"] = LATENCY_BUCKETS_MS
+		# copy first; other threads may add names meanwhile
+		counters = dict(self.counters)
+		histograms = dict(self.histograms)
+
+		snapshot["counters"] = counters
+		snapshot["rates"] = {}
+		for name in counters:
+			snapshot["rates"][name] = round(counters[name] / elapsed, 2)
+		snapshot["histograms"] = {}
+		for name in histograms:
+			snapshot["histograms"][name] = histograms[name].snapshot()
+
+		if reset:
+			self.intervalStart = now
+			for name in counters:
+				self.counters[name] = 0
+			for name in histograms:
+				histograms[name].reset()
+
+		return snapshot
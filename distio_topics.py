@@ -0,0 +1,63 @@
+# distio_topics
+#
+# Precomputed outbound topics and payloads
+#
+# Every topic a bank publishes to is built once when the bank is
+# attached, indexed by channel (and by level for transitions),
+# so the publish path is a list lookup rather than a str.format
+# and config lookup per event. Constant payloads are pre-encoded
+# to the bytes paho would put on the wire.
+#
+
+# payloads for a channel level; paho sends str(int) encoded
+PAYLOAD_LEVEL = (b"0", b"1")
+PAYLOAD_ONLINE = b"online"
+PAYLOAD_OFFLINE = b"offline"
+
+LOG_LEVELS = ("debug", "info", "warning", "error")
+
+# levels directly under io/{client-name} which a bank name
+# would collide with
+RESERVED_BANK_NAMES = ("get", "response", "interlock", "dio-input", "dio-output", "adc-input")
+
+# a topic we may publish to; paho refuses wildcards
+def validPublishTopic(topic):
+	return isinstance(topic, str) and (len(topic) > 0) and ("+" not in topic) and ("#" not in topic)
+
+# a name used as one level of our topics (bank and rule names)
+def validTopicLevel(name):
+	return validPublishTopic(name) and ("/" not in name)
+
+class distio_topic_table():
+
+	def __init__(self, prefix, numInputs, numOutputs, numAnalogInputs=0):
+
+		# "io/{client-name}" or "io/{client-name}/{bank}"
+		self.prefix = prefix
+
+		self.outputState = ["{0}/dio-output/{1}/state".format(prefix, i) for i in range(numOutputs)]
+		self.inputState = ["{0}/dio-input/{1}/state".format(prefix, i) for i in range(numInputs)]
+		self.inputPullup = ["{0}/dio-input/{1}/pullup".format(prefix, i) for i in range(numInputs)]
+		self.inputCounter = ["{0}/dio-input/{1}/counter".format(prefix, i) for i in range(numInputs)]
+
+		self.analogValue = ["{0}/adc-input/{1}/value".format(prefix, i) for i in range(numAnalogInputs)]
+		self.analogStats = ["{0}/adc-input/{1}/stats".format(prefix, i) for i in range(numAnalogInputs)]
+
+		# indexed [channel][new level]; 0 fall, 1 rise
+		self.inputTransition = [(
+			"{0}/dio-input/{1}/event/transition/fall".format(prefix, i),
+			"{0}/dio-input/{1}/event/transition/rise".format(prefix, i),
+		) for i in range(numInputs)]
+
+# client level topics
+class distio_client_topics():
+
+	def __init__(self, clientName):
+		self.status = "clients/{0}/status".format(clientName)
+		self.stats = "clients/{0}/stats".format(clientName)
+		self.log = dict((level, "log/{0}/{1}".format(clientName, level)) for level in LOG_LEVELS)
+		self.logPrefix = "log/{0}/".format(clientName)
+
+		# state queries; io/{client-name}/get/{query}
+		self.getPrefix = "io/{0}/get/".format(clientName)
+		self.snapshotResponse = "io/{0}/response/snapshot".format(clientName)
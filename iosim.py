@@ -5,29 +5,55 @@
 # Matthew Currie <matthew@ve7mjc.com> December 2015
 #
 # Simple IO adapter simulator
-# subclass DistIoClient and re-implement a number of
+# subclass distio_client and re-implement a number of
 # relevent methods to demonstrate a simple client
 # subclass
 #
 # Requires iosim.json configuration or provide path
 # to configuration via commandline argument
 
-import distioclient
+import math
+import time
+from array import array
 
-class IoSim(distioclient.DistIoClient):
+from distio_client import *
+
+class IoSim(distio_client):
 	
 	def init(self):
 		self.num_dio_inputs = 8
 		self.num_dio_outputs = 8
+		self.num_adc_inputs = 2
+		self.analogSampleTime = None
 	
 	def setDigitalOutput(self, channel, value, quiet = False):
 		print("set_dio_output({0},{1})".format(channel, value))
 		return False
 	
-	def pollInputs(self):
-		# return nothing, which is fine
+	def readDigitalInputs(self):
+		# inputs hold steady at their cached state
 		# todo, add random bit flipping to create real
 		# events to work with
-		pass
+		return self.state.inputs.state
+
+	# simulated ADC: a 50Hz sine on a 2048 count bias, with a
+	# slowly drifting amplitude on the second channel, sampled
+	# at the configured rate since the previous call
+	def readAnalogSamples(self):
+		now = time.monotonic()
+		if self.analogSampleTime is None:
+			self.analogSampleTime = now
+		count = int((now - self.analogSampleTime) * self.analogSampleRateHz)
+		if not count:
+			return None
+		period = 1.0 / self.analogSampleRateHz
+		start = self.analogSampleTime
+		self.analogSampleTime += count * period
+
+		blocks = []
+		for channel in range(self.num_adc_inputs):
+			amplitude = 1000.0 if channel == 0 else 500.0 + 400.0 * math.sin(start / 10.0)
+			blocks.append(array("d", (2048.0 + amplitude * math.sin(2 * math.pi * 50 * (start + i * period)) for i in range(count))))
+		return blocks
 			
 sim = IoSim()
@@ -12,9 +12,15 @@
 #
 
 from distio_client import *
+from distio_bank import distio_bank
+import distio_clock
 import pifacedigitalio
 
-class piface_adapter(distio_client):
+# one PiFace Digital board; stacked boards are distinguished
+# by their jumper selected hardware address (0-3)
+class piface_bank(distio_bank):
+
+	hardwareAddress = 0
 
 	def init(self):
 
@@ -22,11 +28,12 @@ class piface_adapter(distio_client):
 		self.num_dio_outputs = 8
 		self.digitalInputPollingEnabled = False
 		
-		# debounce
-		# could add code for debounce per input if needed
-		self.debounceTimeSecs = 0.10
+		# contact debounce is done by distio_client; the 100ms
+		# settle time formerly given to the listener is kept as
+		# the default lockout profile
+		self.inputDebounce = {"algorithm": "lockout", "timeMs": 100}
 		
-		self.pfd =  pifacedigitalio.PiFaceDigital()
+		self.pfd =  pifacedigitalio.PiFaceDigital(hardware_addr=self.hardwareAddress)
 
 		# Create listener and attach event for each input
 		self.listener = pifacedigitalio.InputEventListener(chip=self.pfd)
@@ -34,17 +41,22 @@ class piface_adapter(distio_client):
 	def start(self):
 		
 		# Create interrupt callbacks for all inputs
-		# in both directions (rising and falling) with a
-		# debounce or settle timer, and active the 
-		# listerner thread
+		# in both directions (rising and falling) and
+		# active the listerner thread; every edge is
+		# delivered and debounced by the client
 		for i in range(self.num_dio_inputs):
-			self.listener.register(i, pifacedigitalio.IODIR_BOTH, self.digitalInputInterrupt, self.debounceTimeSecs)
+			self.listener.register(i, pifacedigitalio.IODIR_BOTH, self.digitalInputInterrupt, 0)
 		self.listener.activate()
 
 	def setDigitalOutput(self, channel, value, quiet = False):
 		self.pfd.output_pins[channel].value = value
 		return False
 
+	# all 8 relays switch with one output_port write
+	def setDigitalOutputs(self, word, mask):
+		self.pfd.output_port.value = word
+		return False
+
 	def setDigitalInputPullup(self, channel, value):
 		self.pfd.gppub.bits[channel].value = value
 		return False
@@ -53,9 +65,30 @@ class piface_adapter(distio_client):
 		if (channel >= 0) and (channel < self.num_dio_inputs):
 			return self.pfd.input_pins[channel].value
 		else:
-			self.writeLog("attempt to read digital input ({0}) outside of range({1})".format(channel, self.num_dio_inputs))
+			self.client.writeLog("attempt to read digital input ({0}) outside of range({1})".format(channel, self.num_dio_inputs))
+
+	# one SPI transaction returns all 8 inputs
+	def readDigitalInputs(self):
+		return self.pfd.input_port.value
 
 	def digitalInputInterrupt(self, event):
-		self.digitalInputChanged(event.pin_num, event.direction, event.timestamp)
+		# pifacecommon stamps events with the wall clock
+		self.digitalInputChanged(event.pin_num, event.direction, distio_clock.fromWall(event.timestamp))
+
+# Board 0 is the client's own bank; further stacked boards
+# are listed by hardware address in the config and are
+# published as io/{client-name}/board{n}/...
+#
+# "pifaceBoards": [1, 2, 3]
+class piface_adapter(piface_bank, distio_client):
+
+	def init(self):
+
+		piface_bank.init(self)
+
+		for address in (self.config.param("pifaceBoards") or []):
+			board = piface_bank("board{0}".format(int(address)))
+			board.hardwareAddress = int(address)
+			self.addBank(board)
 
 pi = piface_adapter()